@@ -1,12 +1,21 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import argparse
+import atexit
+import collections
+import ctypes
+import ctypes.util
 import datetime
+import errno
+import fcntl
 import hashlib
 from math import floor
 import io
+import mmap
+import multiprocessing
 import os
 import piexif
+from piexif import _webp
 import pickle
 import json
 from PIL import Image, UnidentifiedImageError
@@ -15,13 +24,20 @@ import numpy
 import pathlib
 import photohash
 import pprint
+import queue
 import re
 import requests
+import select
+import stat
+import struct
+import threading
 import time
 import traceback
 import sys
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from shutil import copy2
+from xml.etree import ElementTree
 
 ROOT_DIR = os.path.abspath(os.getcwd())
 IMPORTER_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -38,6 +54,7 @@ EXTENSIONS_TO_IMPORT = [
     "png",
     "gif",
     "bmp",
+    "tif",
     "tiff",
     "raw",
     "mov",
@@ -78,6 +95,7 @@ IMAGE_EXTENSIONS = [
     "png",
     "gif",
     "bmp",
+    "tif",
     "tiff",
     "raw",
     "crw",
@@ -88,6 +106,13 @@ EXTENSIONS_TO_IGNORE = [
     "xml",
     "plist",
 ]
+# Compiled forms of the lists above, so ignored() is a set lookup and a single regex scan.
+IGNORED_EXTENSIONS = frozenset(EXTENSIONS_TO_IGNORE)
+IMPORTED_EXTENSIONS = frozenset(EXTENSIONS_TO_IMPORT)
+IGNORED_PARTIALS_RE = re.compile("|".join(re.escape(p) for p in PARTIALS_TO_IGNORE))
+IGNORED_CACHE = {}
+# Images piexif reads the EXIF of itself; the others go to exiftool.
+EXIF_EXTENSIONS = frozenset(["jpg", "jpeg", "tif", "tiff"])
 
 # Strings that might already be in the filename from previous systems, and what device to map them to.
 DEVICE_SUBSTRINGS = {
@@ -596,6 +621,31 @@ PRE_EXIF_GPS_LOCATIONS = {
 UNKNOWN_PLACE_NAME = "Unknown"
 MAXIMUM_THUMBNAIL_HASH_DISTANCE = 8
 MAXIMUM_IDENTICAL_HASH_DISTANCE = 1
+# How many directories to list in parallel while discovering source files.
+DISCOVERY_THREADS = 8
+# How many directories to list (and files to read with --workers) at once on any one device (st_dev), across all
+# sources. It defaults to DISCOVERY_THREADS on purpose, so SSDs and cards aren't held back; spinning disks want 1.
+DEVICE_JOBS = DISCOVERY_THREADS
+# Print a progress dot every this many discovered files.
+DISCOVERY_DOT_EVERY = 1000
+# Long-running `exiftool -stay_open` processes per importer process, and how long one file may take.
+EXIFTOOL_PROCESSES = 2
+EXIFTOOL_TIMEOUT_SECONDS = 30
+# Images piexif can't read are sent to exiftool a directory at a time, at most this many files per call.
+EXIFTOOL_BATCH_SIZE = 200
+# --watch: a new file is imported once it has had no events and kept the same size for this long.
+WATCH_SETTLE_SECONDS = 5
+# --watch without inotify (e.g. macOS): how often to rescan the source directory.
+WATCH_POLL_SECONDS = 30
+# Linux ioctl for a file's extent map, used by --physical-order.
+FS_IOC_FIEMAP = 0xC020660B
+
+# How many files ahead of extraction to start reading images into the OS cache, and how many bytes that may be.
+PREFETCH_FILES = 8
+PREFETCH_BYTES = 256 * 1024 ** 2
+# Images up to this size are read into memory once and shared by all the readers. Bigger ones (TIFF, RAW) are
+# mapped instead, so a few of them at once across --workers don't each hold their whole file.
+IMAGE_BUFFER_BYTES = 32 * 1024 ** 2
 
 if os.path.exists("/System/Applications/Preview.app"):
     preview_path = "/System/Applications/Preview.app"
@@ -612,18 +662,465 @@ class Device(object):
         self.regex_str = regex_str
         self.start_date = start_date
 
+
+class StreamingFileList(object):
+    """A file list that background threads keep filling while it's being iterated.
+
+    Each source iterator is walked concurrently in its own thread, but files are always iterated
+    source by source, in the order the iterators were given, so runs are repeatable.
+    """
+
+    def __init__(self, *file_iters):
+        self.parts = [[] for file_iter in file_iters]
+        self.parts_done = [False for file_iter in file_iters]
+        self.error = None
+        self._changed = threading.Condition()
+        self._threads = []
+        for part, file_iter in enumerate(file_iters):
+            thread = threading.Thread(target=self._fill, args=(part, file_iter), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def done(self):
+        return all(self.parts_done)
+
+    def _fill(self, part, file_iter):
+        try:
+            for file_path in file_iter:
+                with self._changed:
+                    self.parts[part].append(file_path)
+                    self._changed.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._changed:
+                self.parts_done[part] = True
+                self._changed.notify_all()
+
+    def _wait_for(self, part, index):
+        # Blocks until parts[part][index] exists or that source's discovery has finished.
+        with self._changed:
+            while index >= len(self.parts[part]) and not self.parts_done[part]:
+                self._changed.wait()
+        if self.error and index >= len(self.parts[part]):
+            raise self.error
+        return index < len(self.parts[part])
+
+    def __iter__(self):
+        for part in range(len(self.parts)):
+            index = 0
+            while self._wait_for(part, index):
+                yield self.parts[part][index]
+                index += 1
+
+    def __len__(self):
+        # Waits until there is at least one file (or none at all), then returns the count so far.
+        with self._changed:
+            while not any(self.parts) and not self.done:
+                self._changed.wait()
+        return sum(len(files) for files in self.parts)
+
+    def __getitem__(self, index):
+        # Waits for the sources before the one holding index to finish, since only then is its position known.
+        position = index
+        for part in range(len(self.parts)):
+            if self._wait_for(part, position):
+                return self.parts[part][position]
+            position -= len(self.parts[part])
+        raise IndexError(index)
+
+    def progress_total(self):
+        # While any walk is still running, the total is a lower bound.
+        total = sum(len(files) for files in self.parts)
+        if self.done:
+            return total
+        return "%s+" % total
+
+
+class Inotify(object):
+    """Minimal ctypes wrapper around Linux inotify, used by --watch."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self.watches = {}
+
+    @classmethod
+    def available(cls):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"))
+            return hasattr(libc, "inotify_init")
+        except OSError:
+            return False
+
+    def add_watch(self, dir_path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(dir_path), self.WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed for %s" % dir_path)
+        self.watches[wd] = dir_path
+
+    def read_events(self, timeout):
+        """Returns [(path, mask)] for events that arrive within timeout seconds."""
+        events = []
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return events
+        data = os.read(self.fd, 65536)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, name_len = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b"\0")
+            offset += name_len
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+            elif mask & self.IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif wd in self.watches:
+                events.append((os.path.join(self.watches[wd], os.fsdecode(name)), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class ExiftoolProcess(object):
+    """One long-running `exiftool -stay_open True -@ -`, answering one request at a time.
+
+    Saves exiftool's (Perl) startup on every file. The process is started on first use, and killed and
+    restarted on the next request if it times out or dies.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.process = None
+        self.request_id = 0
+
+    def start(self):
+        self.process = subprocess.Popen(
+            ["exiftool", "-stay_open", "True", "-@", "-"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+
+    def kill(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def execute(self, *args):
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        self.request_id += 1
+        ready = b"{ready%d}" % self.request_id
+        request = b"".join(os.fsencode(arg) + b"\n" for arg in args) + b"-execute%d\n" % self.request_id
+        try:
+            self.process.stdin.write(request)
+            self.process.stdin.flush()
+        except OSError:
+            self.kill()
+            raise
+
+        output = b""
+        fd = self.process.stdout.fileno()
+        deadline = time.time() + self.timeout
+        while ready not in output:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                self.kill()
+                raise TimeoutError("exiftool took more than %ss on %s" % (self.timeout, " ".join(args)))
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                self.kill()
+                raise OSError("exiftool exited while reading %s" % " ".join(args))
+            output += chunk
+        return output[:output.index(ready)].decode(errors="replace")
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            try:
+                self.process.stdin.write(b"-stay_open\nFalse\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=self.timeout)
+            except (OSError, subprocess.TimeoutExpired):
+                self.kill()
+        self.process = None
+
+
+class ExiftoolPool(object):
+    """A fixed set of ExiftoolProcess, handed out one request at a time."""
+
+    def __init__(self, size, timeout):
+        self.processes = [ExiftoolProcess(timeout) for i in range(size)]
+        self._idle = queue.Queue()
+        for process in self.processes:
+            self._idle.put(process)
+
+    def execute(self, *args):
+        process = self._idle.get()
+        try:
+            return process.execute(*args)
+        finally:
+            self._idle.put(process)
+
+    def close(self):
+        for process in self.processes:
+            process.close()
+
+class FilenameClassifier(object):
+    """Device and capture time from a file name, via DEVICE_REGEXES, DEVICE_SUBSTRINGS, DATE_PARSERS and
+    DATE_FORMAT_PATTERNS, compiled once.
+
+    All the regexes are combined into one pattern of optional lookaheads at the start of the name, so a single
+    match says which of them apply. Times are built from the integer fields of the DATE_FORMAT_PATTERNS entry,
+    using the same field patterns strptime does, and memoized by the matched text.
+    """
+
+    # Same per-field patterns as _strptime.TimeRE, for the directives DATE_FORMAT_PATTERNS uses.
+    FORMAT_FIELDS = {
+        "Y": r"(?P<Y>\d\d\d\d)",
+        "m": r"(?P<m>1[0-2]|0[1-9]|[1-9])",
+        "d": r"(?P<d>3[01]|[12]\d|0[1-9]|[1-9]| [1-9])",
+        "H": r"(?P<H>2[0-3]|[0-1]\d|\d)",
+        "I": r"(?P<I>1[0-2]|0[1-9]|[1-9])",
+        "M": r"(?P<M>[0-5]\d|\d)",
+        "S": r"(?P<S>6[0-1]|[0-5]\d|\d)",
+        "p": r"(?P<p>am|pm)",
+    }
+
+    def __init__(self, device_regexes, device_substrings, date_parsers, date_formats):
+        self.device_substrings = list(device_substrings.items())
+        self.devices = list(device_regexes)
+        self.date_keys = list(date_parsers)
+        lookaheads = []
+        for prefix, patterns in (("r", device_regexes.values()), ("d", date_parsers.values())):
+            for i, pattern in enumerate(patterns):
+                # Unanchored patterns behave like re.findall's first match.
+                if pattern.startswith("^"):
+                    lookaheads.append("(?=(?P<%s%s>%s))?" % (prefix, i, pattern[1:]))
+                else:
+                    lookaheads.append("(?=.*?(?P<%s%s>%s))?" % (prefix, i, pattern))
+        self.pattern = re.compile("".join(lookaheads))
+        self.formats = {}
+        for key in self.date_keys:
+            if key in date_formats:
+                self.formats[key] = (self.compile_format(date_formats[key]), date_formats[key])
+        self.parsed = {}
+
+    def compile_format(self, date_format):
+        # None if it uses a directive we don't build by hand; those go through strptime.
+        parts = []
+        for i, token in enumerate(re.split(r"(%.)", date_format)):
+            if i % 2:
+                if token[1] not in self.FORMAT_FIELDS:
+                    return None
+                parts.append(self.FORMAT_FIELDS[token[1]])
+            else:
+                parts.append(r"\s+".join(re.escape(literal) for literal in re.split(r"\s+", token)))
+        return re.compile("".join(parts), re.IGNORECASE)
+
+    def device(self, file_name):
+        # A matching DEVICE_REGEXES entry, overridden by the first DEVICE_SUBSTRINGS entry in the name.
+        device = None
+        match = self.pattern.match(file_name)
+        for i, regex_device in enumerate(self.devices):
+            if match.group("r%s" % i) is not None:
+                device = regex_device
+                break
+        for substring, substring_device in self.device_substrings:
+            if substring in file_name:
+                return substring_device
+        return device
+
+    def dates(self, file_name, only_key=None):
+        # [(key, datetime)] for every DATE_PARSERS entry that matches and parses, in DATE_PARSERS order.
+        match = self.pattern.match(file_name)
+        dates = []
+        for i, key in enumerate(self.date_keys):
+            if (only_key is not None and key != only_key) or key not in self.formats:
+                continue
+            text = match.group("d%s" % i)
+            if text is None:
+                continue
+            if (key, text) not in self.parsed:
+                self.parsed[(key, text)] = self.parse(key, text)
+            if self.parsed[(key, text)] is not None:
+                dates.append((key, self.parsed[(key, text)]))
+        return dates
+
+    def parse(self, key, text):
+        compiled, date_format = self.formats[key]
+        try:
+            if compiled is None:
+                return datetime.datetime.strptime(text, date_format)
+            fields = compiled.fullmatch(text)
+            if fields is None:
+                return None
+            fields = fields.groupdict()
+            if fields.get("I"):
+                hour = int(fields["I"]) % 12
+                if (fields.get("p") or "").lower() == "pm":
+                    hour += 12
+            else:
+                hour = int(fields.get("H") or 0)
+            return datetime.datetime(
+                int(fields.get("Y") or 1900), int(fields.get("m") or 1), int(fields.get("d") or 1),
+                hour, int(fields.get("M") or 0), int(fields.get("S") or 0),
+            )
+        except ValueError:
+            # Rarely, a file will start with a match, but it's really just a random assortment of hex.
+            return None
+
+class FileRecord(object):
+    """One source file's metadata, replacing the per-file meta dict.
+
+    It still reads like that dict (meta["datetime"], "lat" in meta, meta.update(...), "%(device)s" % meta), but the
+    known fields live in slots, the strings repeated across thousands of files (device, places) are interned, and
+    it pickles as a dict of the fields that are set, so adding, removing or reordering fields keeps old brains
+    and caches loadable. Unknown keys go in a small overflow dict.
+    """
+
+    # Append-only: brains saved before records pickled by name store a bitmask over this order.
+    FIELDS = (
+        "file_path", "relative_file_path", "extension", "source_name", "file_name", "is_image",
+        "datetime", "exiftime", "mtime", "utc_offset", "Camera Model", "width", "height",
+        "lat", "lon", "altitude", "sea_level", "device", "person", "country", "city", "state",
+        "datetimestr", "mtimestr", "cleaned_name", "canonical_name", "canonical_path",
+        "imagehashes", "lowest_distance", "lowest_distance_from", "filesize", "md5",
+        "result", "original", "replaced", "error", "failed", "sidecar",
+    )
+    INTERNED = frozenset(["extension", "Camera Model", "device", "person", "country", "city", "state", "result"])
+    SLOT_NAMES = dict((field, field.lower().replace(" ", "_")) for field in FIELDS)
+    __slots__ = tuple(field.lower().replace(" ", "_") for field in FIELDS) + ("extra",)
+
+    def __init__(self, fields=None):
+        self.extra = None
+        if fields is not None:
+            self.update(fields)
+
+    def __getitem__(self, key):
+        slot = self.SLOT_NAMES.get(key)
+        if slot is not None:
+            try:
+                return getattr(self, slot)
+            except AttributeError:
+                raise KeyError(key)
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.INTERNED and type(value) is str:
+            value = sys.intern(value)
+        slot = self.SLOT_NAMES.get(key)
+        if slot is not None:
+            setattr(self, slot, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        slot = self.SLOT_NAMES.get(key)
+        try:
+            if slot is not None:
+                delattr(self, slot)
+            else:
+                del (self.extra or {})[key]
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        slot = self.SLOT_NAMES.get(key)
+        if slot is not None:
+            return hasattr(self, slot)
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def keys(self):
+        keys = [field for field in self.FIELDS if hasattr(self, self.SLOT_NAMES[field])]
+        return keys + list(self.extra or ())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def update(self, fields):
+        for key in fields.keys():
+            self[key] = fields[key]
+
+    def copy(self):
+        return FileRecord(self)
+
+    def __getstate__(self):
+        return dict(self.items())
+
+    def __setstate__(self, state):
+        self.extra = None
+        if isinstance(state, dict):
+            # A field that no longer exists comes back as an unknown key rather than failing the load.
+            self.update(state)
+            return
+        # Older pickles: (bitmask over FIELDS, the set values in order, overflow dict).
+        mask, values, extra = state
+        values = iter(values)
+        for i, field in enumerate(self.FIELDS):
+            if mask & (1 << i):
+                self[field] = next(values)
+        self.update(extra or {})
+
 # Cybershot = Device("Cybershot", r"DSC*", datetime.date(2013, 12, 31))
 # Cybershot = Device("Cybershot", "", datetime.date(2013, 12, 31))
 
-try:
-    with open('importamator.db', 'rb') as f:
-        brain = pickle.load(f)
-    print("✔ Loaded brain from importamator.db.")
-    # print(brain)
-except Exception as e:
-    print("✔ No Brain Found, creating a new one.")
-    brain = {}
-    pass
+brain = {}
+# --workers processes re-import this file as __mp_main__, and only the coordinator needs the brain.
+if __name__ != "__mp_main__":
+    try:
+        with open('importamator.db', 'rb') as f:
+            brain = pickle.load(f)
+        print("✔ Loaded brain from importamator.db.")
+        # print(brain)
+    except Exception as e:
+        print("✔ No Brain Found, creating a new one.")
+        brain = {}
+        pass
 
 if "date_country" not in brain:
     brain["date_country"] = {}
@@ -636,12 +1133,86 @@ if "month_country" not in brain:
 if "imagehashes" not in brain:
     brain["imagehashes"] = {}
 
+# Brains from before FileRecord hold plain dicts. Convert them, keeping an entry that's filed under several
+# rotation hashes a single record.
+migrated_records = {}
+for brain_hash, brain_meta in brain["imagehashes"].items():
+    if isinstance(brain_meta, dict):
+        if id(brain_meta) not in migrated_records:
+            migrated_records[id(brain_meta)] = FileRecord(brain_meta)
+        brain["imagehashes"][brain_hash] = migrated_records[id(brain_meta)]
+migrated_records = None
+
 action_log = ""
+# Discovery threads log too, and += on a string isn't atomic.
+ACTION_LOG_LOCK = threading.Lock()
 now_str = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 # now_str = "dev"
 
+# Device and date patterns for file names, compiled once.
+FILENAME_CLASSIFIER = FilenameClassifier(DEVICE_REGEXES, DEVICE_SUBSTRINGS, DATE_PARSERS, DATE_FORMAT_PATTERNS)
+
+# Started on first use by run_exiftool.
+EXIFTOOL = None
+
+# Batched exiftool output for files extract_file_info hasn't reached yet, keyed by path.
+EXIFTOOL_BATCH_RESULTS = {}
+
+# What extract_file_info found for each file this run, keyed by path, so the second pass can reuse it.
 CACHED_FILE_INFO = {}
 
+# Extracted info, image hashes and md5s from previous runs, keyed by file identity (dev, ino, size, mtime_ns).
+# Bump FILE_CACHE_VERSION when extract_file_info changes what it records.
+FILE_CACHE_FILE = "importamator-files.cache"
+FILE_CACHE_VERSION = 2
+FILE_CACHE = None
+
+# --workers: how many processes do per-file extraction and hashing, and how many files they may run ahead.
+METADATA_WORKERS = 1
+METADATA_LOOKAHEAD_PER_WORKER = 4
+# Devices whose filesystem doesn't answer FIEMAP, so --physical-order falls back to inode order without asking again.
+FIEMAP_UNSUPPORTED = set()
+# physical_location results by path, so files sorted before checking and again before copying cost one FIEMAP each.
+PHYSICAL_LOCATIONS = {}
+
+# Reads files into the OS cache where posix_fadvise isn't available (e.g. macOS). Started on first use.
+PREFETCH_POOL = None
+
+# Worker futures for files the coordinator hasn't reached yet, keyed by path.
+PENDING_FILE_INFO = {}
+PENDING_IMAGE_HASHES = {}
+
+# Directory listings from previous runs, keyed by absolute directory path.
+SCAN_INDEX_FILE = "importamator-scan.idx"
+SCAN_INDEX_VERSION = 4
+SCAN_INDEX = None
+SCAN_INDEX_LOCK = threading.Lock()
+
+# One semaphore per device, limiting concurrent directory listing to DEVICE_JOBS.
+DEVICE_SEMAPHORES = {}
+DEVICE_SEMAPHORES_LOCK = threading.Lock()
+
+# Other paths (symlinks, linked folders) that led to an already-discovered file, keyed by the path we kept.
+FILE_ALIASES = {}
+# Guards the seen_files dict that the source walks of one discovery pass share, since their walks can overlap.
+SEEN_FILES_LOCK = threading.Lock()
+
+# .xmp sidecars seen during discovery, as (path, stat tuple), keyed by (directory, lowercased name without ".xmp").
+# Both "IMG_0001.CR2.xmp" (darktable) and "IMG_0001.xmp" (Lightroom) are found this way.
+SIDECARS = {}
+# Directories whose sidecars are in SIDECARS, either from discovery or listed by find_sidecar.
+SIDECAR_DIRS = set()
+XMP_NAMESPACES = {
+    "exif": "http://ns.adobe.com/exif/1.0/",
+    "tiff": "http://ns.adobe.com/tiff/1.0/",
+    "xmp": "http://ns.adobe.com/xap/1.0/",
+    "photoshop": "http://ns.adobe.com/photoshop/1.0/",
+}
+
+# The one stat taken for each source file this run, keyed by path. Sizes and mtimes come from here.
+FileStat = collections.namedtuple("FileStat", ["dev", "ino", "size", "mtime_ns"])
+FILE_STATS = {}
+
 #  Backup to Server
 # rsync -hPav /Volumes/MAPLE\ SEED/Capture "skoczen@hematite:/Volumes/Banded\ Iron/Movies/"
 
@@ -654,7 +1225,8 @@ try:
 
     def log_action(action):
         global action_log
-        action_log += "\n%s" % action
+        with ACTION_LOG_LOCK:
+            action_log += "\n%s" % action
 
     def convert_to_degrees(value):
         """Helper function to convert the GPS coordinates stored in the EXIF to degress in float format"""
@@ -673,6 +1245,90 @@ try:
 
         return d + (m / 60.0) + (s / 3600.0)
 
+    def run_exiftool(*args):
+        global EXIFTOOL
+        if EXIFTOOL is None:
+            EXIFTOOL = ExiftoolPool(EXIFTOOL_PROCESSES, EXIFTOOL_TIMEOUT_SECONDS)
+            atexit.register(EXIFTOOL.close)
+        return EXIFTOOL.execute(*args)
+
+    def parse_exiftool_output(exif_output):
+        exif_dict = {}
+        for line in exif_output.split("\n"):
+            try:
+                # Values can contain ": " too (times, lens descriptions), so only split on the first one.
+                k, v = line.split(": ", 1)
+                exif_dict[k.strip()] = v.strip()
+            except:
+                log_action("Skipping %s" % line)
+        return exif_dict
+
+    def needs_exiftool_batch(file_path):
+        # Images piexif can't read at all, so they'd go to exiftool one at a time otherwise.
+        extension = file_path.split(".")[-1].lower()
+        return (
+            extension in IMAGE_EXTENSIONS and extension not in EXIF_EXTENSIONS and
+            file_path not in EXIFTOOL_BATCH_RESULTS and file_path not in PENDING_FILE_INFO and not ignored(file_path) and
+            find_sidecar(file_path) is None and
+            file_stat(file_path).size > 0 and cached_file_info(file_path) is None
+        )
+
+    def run_exiftool_batch(file_paths):
+        # One `exiftool -json` call for many files. Results are stored under the names the plain output uses.
+        json_names = {
+            "Model": "Camera Model Name",
+            "ImageWidth": "Image Width",
+            "ImageHeight": "Image Height",
+            "DateTimeOriginal": "Date/Time Original",
+            "SubSecTimeOriginal": "Sub Sec Time Original",
+            "OffsetTimeOriginal": "Offset Time Original",
+        }
+        try:
+            results = json.loads(run_exiftool("-json", "-fast2", *(["-%s" % k for k in json_names] + file_paths)))
+        except Exception as e:
+            # The files just fall back to exiftool one at a time.
+            log_action("Batched exiftool failed for %s files in %s: %s" % (
+                len(file_paths), os.path.dirname(file_paths[0]), e
+            ))
+            return
+        # exiftool may spell SourceFile differently (e.g. without "./"), so results are matched on normalized paths.
+        requested = dict((os.path.normpath(file_path), file_path) for file_path in file_paths)
+        for result in results:
+            file_path = requested.pop(os.path.normpath(result.get("SourceFile", "")), None)
+            if file_path is not None:
+                EXIFTOOL_BATCH_RESULTS[file_path] = dict(
+                    (json_names[k], str(v)) for k, v in result.items() if k in json_names
+                )
+        for file_path in requested.values():
+            log_action("Batched exiftool returned nothing for %s, reading it on its own" % file_path)
+
+    def iter_with_exiftool_batches(file_list):
+        # Yields file_list unchanged, in order. Discovery lists a directory's files together, so files are held
+        # back from the first one that needs exiftool until a file from another directory arrives, and the
+        # directory's batch is sent at once.
+        batch_dir = None
+        batch = []
+        held = []
+        for file_path in file_list:
+            file_dir = os.path.dirname(file_path)
+            if batch and (file_dir != batch_dir or len(batch) >= EXIFTOOL_BATCH_SIZE):
+                run_exiftool_batch(batch)
+                for held_path in held:
+                    yield held_path
+                batch = []
+                held = []
+            if needs_exiftool_batch(file_path):
+                batch_dir = file_dir
+                batch.append(file_path)
+            if batch:
+                held.append(file_path)
+            else:
+                yield file_path
+        if batch:
+            run_exiftool_batch(batch)
+            for held_path in held:
+                yield held_path
+
     def md5_file(file_path):
         buffer_size = 1048576  # 1MB chunks
 
@@ -687,7 +1343,7 @@ try:
 
         return md5.hexdigest()
 
-    def image_hashes(file_path):
+    def image_hashes(file_path, data=None):
         # image = Image.open(file_path)
         # img_size = 32
         # image = image.convert("L").resize((img_size, img_size), Image.ANTIALIAS)
@@ -697,7 +1353,7 @@ try:
         # log_action(file_path)
         # log_action(pixels)
 
-        im = Image.open(file_path)
+        im = Image.open(io.BytesIO(data) if data is not None else file_path)
         hashes = [
             str(imagehash.phash(im, hash_size=16)),
             str(imagehash.phash(im.rotate(90), hash_size=16)),
@@ -709,6 +1365,111 @@ try:
         return hashes
         # return photohash.average_hash(file_path)
 
+    def probe_image_size(file_path, data=None):
+        # (width, height) from the first few header bytes, without decoding anything. None for formats
+        # (or oddly-laid-out files) this doesn't know, so the caller can fall back to PIL.
+        with (io.BytesIO(data) if data is not None else open(file_path, "rb")) as f:
+            head = f.read(32)
+            if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR" and len(head) >= 24:
+                return struct.unpack(">II", head[16:24])
+            if head[:6] in (b"GIF87a", b"GIF89a") and len(head) >= 10:
+                return struct.unpack("<HH", head[6:10])
+            if head[:2] == b"BM" and len(head) >= 26:
+                if struct.unpack("<I", head[14:18])[0] == 12:
+                    # OS/2 BITMAPCOREHEADER
+                    return struct.unpack("<HH", head[18:22])
+                width, height = struct.unpack("<ii", head[18:26])
+                return width, abs(height)
+            if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+                f.seek(12)
+                data = f.read(64)
+                if len(data) < 18:
+                    return None
+                chunk = {"fourcc": data[:4], "data": data[8:8 + struct.unpack("<L", data[4:8])[0]]}
+                if chunk["fourcc"] == b"VP8X":
+                    return _webp._get_size_from_vp8x(chunk)
+                if chunk["fourcc"] == b"VP8 ":
+                    return _webp._get_size_from_vp8(chunk)
+                if chunk["fourcc"] == b"VP8L":
+                    return _webp._get_size_from_vp8L(chunk)
+                return None
+            if head[:2] == b"\xff\xd8":
+                # Walk the JPEG segments (skipping APPn/EXIF bodies) to the first SOFn.
+                f.seek(2)
+                while True:
+                    marker = f.read(2)
+                    if len(marker) < 2 or marker[0] != 0xFF:
+                        return None
+                    while marker[1] == 0xFF:
+                        marker = marker[1:] + f.read(1)
+                        if len(marker) < 2:
+                            return None
+                    code = marker[1]
+                    if code == 0xD8 or 0xD0 <= code <= 0xD7 or code == 0x01:
+                        continue
+                    if code == 0xDA or code == 0xD9:
+                        return None
+                    length = f.read(2)
+                    if len(length) < 2:
+                        return None
+                    if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+                        sof = f.read(5)
+                        if len(sof) < 5:
+                            return None
+                        height, width = struct.unpack(">HH", sof[1:5])
+                        return width, height
+                    if struct.unpack(">H", length)[0] < 2:
+                        return None
+                    f.seek(struct.unpack(">H", length)[0] - 2, os.SEEK_CUR)
+        return None
+
+    def decode_exif_datetime(value, subsec=None):
+        # "YYYY:MM:DD HH:MM:SS" (bytes from piexif, str from exiftool) plus SubSecTime digits, as a naive datetime.
+        if isinstance(value, bytes):
+            value = value.decode(errors="replace")
+        if isinstance(subsec, bytes):
+            subsec = subsec.decode(errors="replace")
+        if (
+            len(value) < 19 or value[19:].strip("\x00 ") or
+            value[4] != ":" or value[7] != ":" or value[10] != " " or value[13] != ":" or value[16] != ":"
+        ):
+            raise ValueError("Not an EXIF datetime: %r" % value)
+        microsecond = 0
+        subsec = (subsec or "").strip("\x00 ")
+        if subsec.isdigit():
+            microsecond = int(subsec[:6].ljust(6, "0"))
+        return datetime.datetime(
+            int(value[0:4]), int(value[5:7]), int(value[8:10]),
+            int(value[11:13]), int(value[14:16]), int(value[17:19]), microsecond,
+        )
+
+    def decode_exif_offset(value):
+        # OffsetTime ("+09:00") as a timedelta, or None if missing or malformed.
+        if isinstance(value, bytes):
+            value = value.decode(errors="replace")
+        value = (value or "").strip("\x00 ")
+        if len(value) != 6 or value[0] not in "+-" or value[3] != ":" or not (value[1:3] + value[4:6]).isdigit():
+            return None
+        offset = datetime.timedelta(hours=int(value[1:3]), minutes=int(value[4:6]))
+        return -offset if value[0] == "-" else offset
+
+    def parse_date_arg(value):
+        return datetime.datetime.strptime(value, "%Y-%m-%d")
+
+    def parse_size_arg(value):
+        # "500", "20K", "1.5M", "2G" -> bytes
+        units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+        value = value.strip().upper().rstrip("B")
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+
+    def parse_positive_int_arg(value):
+        number = int(value)
+        if number < 1:
+            raise argparse.ArgumentTypeError("must be at least 1, got %s" % value)
+        return number
+
     def sizeof_fmt(num, suffix='B'):
         for unit in ['', 'K', 'M', 'G', 'T', 'P', 'E', 'Z']:
             if abs(num) < 1024.0:
@@ -750,7 +1511,7 @@ try:
             copy2(source, dest)
             log_action("Copied %s to %s\n" % (source, dest))
         except PermissionError:
-            if os.path.getsize(source) == os.path.getsize(dest):
+            if file_stat(source).size == os.path.getsize(dest):
                 pass
             else:
                 raise PermissionError
@@ -759,57 +1520,349 @@ try:
         with open('importamator.db.bak', "w+b") as f:
             pickle.dump(brain, f)
 
-    def get_local_file_list(source_dir):
-        files = []
-        parse_dirs = []
-        if os.path.islink(source_dir):
-            source_dir = os.readlink(source_dir)
-        else:
-            parse_dirs.append(source_dir)
+    def make_file_stat(st):
+        return FileStat(st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
 
-        for dirpath, dirnames, filenames in os.walk(source_dir, topdown=False):
-            for dirname in dirnames:
-                if os.path.islink(os.path.join(dirpath, dirname)):
-                    if ".." in dirname:
-                        parse_dirs.append(os.path.abspath(os.path.join(dirpath, os.readlink(os.path.join(dirpath, dirname)))))
-                    else:
-                        parse_dirs.append(os.path.abspath(os.path.join(os.path.join(dirpath, dirname))))
-            for filename in filenames:
-                if os.path.islink(os.path.join(dirpath, filename)):
-                    parse_dirs.append(os.readlink(os.path.join(dirpath, filename)))
+    def file_stat(file_path):
+        # Discovery fills FILE_STATS for everything it finds; any other path is stat'ed once, here.
+        if file_path not in FILE_STATS:
+            FILE_STATS[file_path] = make_file_stat(os.stat(file_path))
+        return FILE_STATS[file_path]
 
-        for parse_dir in parse_dirs:
-            for dirpath, dirnames, filenames in os.walk(parse_dir, topdown=False):
-                if os.path.islink(dirpath):
-                    pass
-                else:
-                    for filename in filenames:
-                        if os.path.islink(os.path.join(dirpath, filename)):
-                            if os.path.exists(os.readlink(os.path.join(dirpath, filename))):
-                                files.append(os.readlink(os.path.join(dirpath, filename)))
+    def scan_dir(dir_path):
+        # Lists one directory, using the DirEntry type info to tell files from directories without a stat.
+        # Files come back as (path, FileStat), which is the only stat they get for the rest of the run.
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_symlink():
+                            if entry.is_dir():
+                                subdirs.append((entry.path, entry.stat()))
                             else:
-                                log_action("Could not find file symlinked from %s" % os.path.join(dirpath, filename))
-                        else:
-                            files.append(os.path.join(dirpath, filename))
+                                target = os.path.abspath(os.path.join(dir_path, os.readlink(entry.path)))
+                                if os.path.isfile(target):
+                                    files.append((target, make_file_stat(os.stat(target))))
+                                else:
+                                    log_action("Could not find file symlinked from %s" % entry.path)
+                        elif entry.is_dir(follow_symlinks=False):
+                            subdirs.append((entry.path, entry.stat(follow_symlinks=False)))
+                        elif entry.is_file(follow_symlinks=False):
+                            files.append((entry.path, make_file_stat(entry.stat(follow_symlinks=False))))
+                    except OSError:
+                        log_action("Could not read %s" % entry.path)
+        except OSError:
+            log_action("Could not list %s" % dir_path)
+        return files, subdirs
+
+    def load_scan_index():
+        global SCAN_INDEX
+        if SCAN_INDEX is None:
+            SCAN_INDEX = {}
+            try:
+                with open(SCAN_INDEX_FILE, 'rb') as f:
+                    saved = pickle.load(f)
+                if saved["version"] == SCAN_INDEX_VERSION:
+                    SCAN_INDEX = saved["dirs"]
+            except Exception:
+                pass
+        return SCAN_INDEX
+
+    def write_scan_index():
+        with SCAN_INDEX_LOCK:
+            with open(SCAN_INDEX_FILE, "w+b") as f:
+                pickle.dump({"version": SCAN_INDEX_VERSION, "dirs": SCAN_INDEX}, f)
+
+    def load_file_cache():
+        global FILE_CACHE
+        if FILE_CACHE is None:
+            FILE_CACHE = {}
+            try:
+                with open(FILE_CACHE_FILE, 'rb') as f:
+                    saved = pickle.load(f)
+                if saved["version"] == FILE_CACHE_VERSION and not ARGS.rebuild_file_cache:
+                    FILE_CACHE = saved["files"]
+            except Exception:
+                pass
+        return FILE_CACHE
+
+    def write_file_cache(source_dirs):
+        if FILE_CACHE is None:
+            return
+        # Drop entries for files that are gone or have changed, but only under the sources imported this run:
+        # entries for other cards, or this one while it isn't mounted, are kept for when they come back.
+        # Files seen this run are checked against their discovery stat, so only deleted ones cost a stat.
+        roots = tuple(os.path.join(os.path.abspath(d), "") for d in source_dirs if os.path.isdir(d))
+        seen = dict((os.path.abspath(path), tuple(f_stat)) for path, f_stat in FILE_STATS.items())
+        for key, entry in list(FILE_CACHE.items()):
+            if not entry["path"].startswith(roots):
+                continue
+            if entry["path"] in seen:
+                current = seen[entry["path"]]
+            else:
+                try:
+                    current = tuple(make_file_stat(os.stat(entry["path"])))
+                except OSError:
+                    current = None
+            if current != key:
+                del FILE_CACHE[key]
+        with open(FILE_CACHE_FILE, "w+b") as f:
+            pickle.dump({"version": FILE_CACHE_VERSION, "files": FILE_CACHE}, f)
+
+    def file_cache_entry(file_path, create=False):
+        # The saved entry for this exact file (same identity and name), if it hasn't changed since.
+        key = tuple(file_stat(file_path))
+        entry = load_file_cache().get(key)
+        if entry is not None and entry["file_name"] != os.path.basename(file_path):
+            # Renamed in place; the name feeds device and date detection.
+            entry = None
+        if entry is None and create:
+            entry = {"path": os.path.abspath(file_path), "file_name": os.path.basename(file_path)}
+            FILE_CACHE[key] = entry
+        return entry
+
+    def cached_file_info(file_path):
+        # This run's extract_file_info result, or a previous run's if the file hasn't changed.
+        if file_path not in CACHED_FILE_INFO:
+            entry = file_cache_entry(file_path)
+            if entry is not None and entry.get("sidecar") != find_sidecar(file_path):
+                # The sidecar was added, removed or edited since, e.g. re-tagged in Lightroom.
+                entry = None
+            if entry is not None and entry.get("failures") and ARGS.retry_failures:
+                # Cleared, so this run's results are what gets saved and reported.
+                del entry["failures"]
+                entry.pop("info", None)
+            if entry is not None and "info" in entry:
+                if entry.get("failures"):
+                    log_action("Not retrying %s, unchanged since it failed: %s" % (
+                        file_path, "; ".join("%s (%s)" % item for item in sorted(entry["failures"].items()))
+                    ))
+                info = FileRecord(entry["info"])
+                # Paths (and the source they're relative to) can differ between runs.
+                info.update(new_file_meta(file_path))
+                CACHED_FILE_INFO[file_path] = info
+        return CACHED_FILE_INFO.get(file_path)
+
+    def remember_file_info(file_path, meta):
+        entry = file_cache_entry(file_path, create=True)
+        if "imagehashes" in meta:
+            entry["imagehashes"] = meta.pop("imagehashes")
+        if entry.get("sidecar") != find_sidecar(file_path):
+            entry.get("failures", {}).pop("sidecar", None)
+        if "failures" in meta:
+            entry.setdefault("failures", {}).update(meta.pop("failures"))
+        entry["sidecar"] = find_sidecar(file_path)
+        transient_error = meta.pop("transient_error", None)
+        CACHED_FILE_INFO[file_path] = meta.copy()
+        if transient_error is not None:
+            # Incomplete because of exiftool, not the file, so it's extracted again next run.
+            entry.pop("info", None)
+        else:
+            # Failed results are kept too, so a corrupt file isn't decoded (and sent to exiftool) again next run.
+            entry["info"] = meta.copy()
+
+    def cached_md5(file_path):
+        entry = file_cache_entry(file_path, create=True)
+        if "md5" not in entry:
+            entry["md5"] = md5_file(file_path)
+        return entry["md5"]
+
+    def device_semaphore(dev):
+        with DEVICE_SEMAPHORES_LOCK:
+            if dev not in DEVICE_SEMAPHORES:
+                DEVICE_SEMAPHORES[dev] = threading.BoundedSemaphore(DEVICE_JOBS)
+            return DEVICE_SEMAPHORES[dev]
+
+    def scan_dir_limited(dir_path, dir_stat, full_rescan=False):
+        # Sources on separate devices list in parallel; sources sharing a device share its limit.
+        with device_semaphore(dir_stat.st_dev):
+            return scan_dir_indexed(dir_path, dir_stat, full_rescan=full_rescan)
+
+    def scan_dir_indexed(dir_path, dir_stat, full_rescan=False):
+        # A directory's mtime and ctime only change when entries are added, removed or renamed (ctime also
+        # catches a tool like `rsync -t` or `touch` putting the old mtime back), so an unchanged directory
+        # can reuse its previous listing and skip readdir. Its files are still stat'ed: rewriting a file in
+        # place changes its size and mtime but not the directory's, and the stat keys the file cache.
+        # Subdirectories are stat'ed to check them in turn.
+        index = load_scan_index()
+        key = os.path.abspath(dir_path)
+        stamp = (dir_stat.st_dev, dir_stat.st_ino, dir_stat.st_mtime_ns, dir_stat.st_ctime_ns)
+        cached = index.get(key)
+        if not full_rescan and cached and cached["stamp"] == stamp:
+            files = []
+            for name in cached["files"]:
+                file_path = os.path.join(dir_path, name)
+                try:
+                    files.append((file_path, make_file_stat(os.stat(file_path))))
+                except OSError:
+                    log_action("Could not read %s" % file_path)
+            subdirs = []
+            for name in cached["subdirs"]:
+                subdir_path = os.path.join(dir_path, name)
+                try:
+                    subdirs.append((subdir_path, os.stat(subdir_path)))
+                except OSError:
+                    log_action("Could not read %s" % subdir_path)
+            return files, subdirs
+
+        files, subdirs = scan_dir(dir_path)
+        entry = {
+            "stamp": stamp,
+            # Symlinked files outside this directory keep their absolute target path.
+            "files": [
+                os.path.relpath(f, dir_path) if f.startswith(os.path.join(dir_path, "")) else f
+                for f, f_stat in files
+            ],
+            "subdirs": [os.path.basename(d) for d, d_stat in subdirs],
+        }
+        with SCAN_INDEX_LOCK:
+            index[key] = entry
+        return files, subdirs
+
+    def iter_local_files(source_dir, full_rescan=False, dots=True, seen_files=None):
+        # Directory listings run ahead on a thread pool, but files are yielded in a stable depth-first order.
+        # dots prints progress while listing; it's off when files are checked as they're found, which has its own.
+        # seen_files maps (dev, ino) to the path kept for it; walks in the same pass share one. Each pass starts
+        # fresh, since a later file can reuse a deleted file's inode.
+        if seen_files is None:
+            seen_files = {}
+        if os.path.islink(source_dir):
+            source_dir = os.path.join(os.path.dirname(source_dir), os.readlink(source_dir))
+        root_stat = os.stat(source_dir)
+        visited_dirs = set([(root_stat.st_dev, root_stat.st_ino)])
+        scanned_keys = set([os.path.abspath(source_dir)])
+        found = 0
+        filtered = 0
+
+        with ThreadPoolExecutor(max_workers=DISCOVERY_THREADS) as pool:
+            pending = [(source_dir, pool.submit(scan_dir_limited, source_dir, root_stat, full_rescan))]
+            while pending:
+                listed_dir, listing = pending.pop()
+                files, subdirs = listing.result()
+                # Sidecars are registered before any file in their directory is yielded.
+                register_sidecars(files)
+                SIDECAR_DIRS.add(os.path.normpath(listed_dir))
+                for file_path, f_stat in files:
+                    # Hard links, file symlinks and linked folders can all lead to the same file; only keep the first.
+                    file_id = (f_stat.dev, f_stat.ino)
+                    with SEEN_FILES_LOCK:
+                        kept_path = seen_files.setdefault(file_id, file_path)
+                        if kept_path != file_path:
+                            aliases = FILE_ALIASES.setdefault(kept_path, [])
+                            if file_path not in aliases:
+                                aliases.append(file_path)
+                                log_action("Skipping %s, same file as %s" % (file_path, kept_path))
+                    if kept_path != file_path:
+                        continue
+                    if filtered_out(file_path, f_stat):
+                        filtered += 1
+                        continue
+                    FILE_STATS[file_path] = f_stat
+                    found += 1
+                    if dots and found % DISCOVERY_DOT_EVERY == 0:
                         sys.stdout.write(".")
                         sys.stdout.flush()
-                # if filename.endswith(".html") or filename.endswith(".xml"):
-
-        return files
+                    yield file_path
+
+                children = []
+                for dir_path, dir_stat in subdirs:
+                    if ignored_dir(dir_path):
+                        log_action("Skipping ignored directory %s" % dir_path)
+                        continue
+                    # Symlinked directories can loop back on themselves, so each directory is only listed once.
+                    dir_id = (dir_stat.st_dev, dir_stat.st_ino)
+                    if dir_id in visited_dirs:
+                        log_action("Skipping already-scanned directory %s" % dir_path)
+                        continue
+                    visited_dirs.add(dir_id)
+                    scanned_keys.add(os.path.abspath(dir_path))
+                    children.append((dir_path, pool.submit(scan_dir_limited, dir_path, dir_stat, full_rescan)))
+                pending.extend(reversed(children))
+
+        if filtered:
+            log_action("Filtered out %s files under %s" % (filtered, source_dir))
+
+        # Forget directories under this source that no longer exist, then save for the next run.
+        index = load_scan_index()
+        root_prefix = os.path.join(os.path.abspath(source_dir), "")
+        with SCAN_INDEX_LOCK:
+            for key in list(index.keys()):
+                if key.startswith(root_prefix) and key not in scanned_keys:
+                    del index[key]
+        write_scan_index()
+
+    def get_local_file_list(source_dir, full_rescan=False):
+        return list(iter_local_files(source_dir, full_rescan=full_rescan))
+
+    def register_sidecars(files):
+        for file_path, f_stat in files:
+            if file_path.lower().endswith(".xmp"):
+                SIDECARS[(os.path.dirname(file_path), os.path.basename(file_path)[:-4].lower())] = (file_path, tuple(f_stat))
+
+    def find_sidecar(file_path):
+        # The sidecar discovery listed next to file_path, as (path, stat tuple), or None.
+        dir_path, name = os.path.split(file_path)
+        if os.path.normpath(dir_path) not in SIDECAR_DIRS:
+            # Files from --files-from weren't found through a listing, so their directory is listed here, once.
+            SIDECAR_DIRS.add(os.path.normpath(dir_path))
+            try:
+                with os.scandir(dir_path or ".") as entries:
+                    register_sidecars([
+                        (os.path.join(dir_path, entry.name), make_file_stat(entry.stat()))
+                        for entry in entries if entry.name.lower().endswith(".xmp") and entry.is_file()
+                    ])
+            except OSError as e:
+                log_action("Could not list %s for sidecars: %s" % (dir_path, e))
+        sidecar = SIDECARS.get((dir_path, name.lower()))
+        if sidecar is None:
+            sidecar = SIDECARS.get((dir_path, os.path.splitext(name)[0].lower()))
+        return sidecar
+
+    def relative_file_path(file_path):
+        # Relative to whichever source the file came from, trying the longest source paths first. With several
+        # sources, the source is kept at the front, since cards often share a layout (DCIM/100CANON/IMG_0001.JPG).
+        for source_dir in sorted(ARGS.source_dirs, key=len, reverse=True):
+            relative_path = file_path.replace(source_dir, "").replace(os.path.abspath(source_dir), "")
+            if relative_path != file_path:
+                if len(ARGS.source_dirs) > 1:
+                    return os.path.join(source_dir, relative_path.lstrip("/"))
+                return relative_path
+        return file_path
 
     def ignored(file_path):
-        if file_path.split(".")[-1].lower() in EXTENSIONS_TO_IGNORE:
-            return True
+        if file_path in IGNORED_CACHE:
+            return IGNORED_CACHE[file_path]
+
+        extension = file_path.split(".")[-1].lower()
+        is_ignored = (
+            extension in IGNORED_EXTENSIONS or
+            (not ARGS.all_files and extension not in IMPORTED_EXTENSIONS) or
+            IGNORED_PARTIALS_RE.search(file_path) is not None
+        )
+        IGNORED_CACHE[file_path] = is_ignored
+        return is_ignored
 
-        if not ARGS.all_files and file_path.split(".")[-1].lower() not in EXTENSIONS_TO_IMPORT:
+    def filtered_out(file_path, f_stat):
+        # --since/--until/--min-size/--max-size/--ext, checked against the discovery stat so excluded
+        # files never reach parse_file_list.
+        if ARGS.since and f_stat.mtime_ns < ARGS.since_ns:
+            return True
+        if ARGS.until and f_stat.mtime_ns >= ARGS.until_ns:
+            return True
+        if ARGS.min_size is not None and f_stat.size < ARGS.min_size:
+            return True
+        if ARGS.max_size is not None and f_stat.size > ARGS.max_size:
+            return True
+        if ARGS.ext and file_path.split(".")[-1].lower() not in ARGS.ext:
             return True
-
-        for p in PARTIALS_TO_IGNORE:
-            if p in file_path:
-                return True
-
         return False
 
+    def ignored_dir(dir_path):
+        # Every file below a directory contains its path, so a partial match here ignores the whole subtree.
+        return IGNORED_PARTIALS_RE.search(os.path.join(dir_path, "")) is not None
+
     def eta(start_time, size_copied, total_size):
         if size_copied > 0:
             elapsed = datetime.datetime.now() - start_time
@@ -821,35 +1874,246 @@ try:
             return "%02d:%02d:%02d" % (remaining_hours, remaining_minutes, remaining_seconds)
         return "Unknown"
 
-    def get_file_metadata(file_path, exif_gps_only=False):
-        global ARGS
-        meta = {}
-        error_str = None
-
-        # Get file type from extension (which we trust, because why not. I'm not sniffing headers for this.)
-        extension = file_path.split(".")[-1]
-        meta["file_path"] = file_path
-        meta["relative_file_path"] = file_path.replace(ARGS.source_dir, "").replace(ARGS.full_source_path, "")
-        meta["extension"] = extension
-        meta["source_name"] = file_path.split("/")[-1]
-        meta["file_name"] = file_path.split("/")[-1]
-        meta["is_image"] = extension.lower() in IMAGE_EXTENSIONS
-
-        if exif_gps_only:
-            log_action("Checked %s." % meta["relative_file_path"])
+    def read_boxes(f, start, end):
+        # (type, payload offset, payload end) for each ISO-BMFF box between start and end, seeking past payloads.
+        offset = start
+        while offset + 8 <= end:
+            f.seek(offset)
+            header = f.read(8)
+            if len(header) < 8:
+                return
+            size, box_type = struct.unpack(">I4s", header)
+            payload = offset + 8
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0]
+                payload += 8
+            elif size == 0:
+                size = end - offset
+            if size < payload - offset:
+                return
+            yield box_type, payload, min(offset + size, end)
+            offset += size
+
+    def parse_iso6709(value):
+        # "+37.3349-122.0090+010.000/" -> (lat, lon, altitude or None)
+        match = re.match(r"([+-]\d+(?:\.\d*)?)([+-]\d+(?:\.\d*)?)([+-]\d+(?:\.\d*)?)?", value)
+        if not match:
+            return None
+        return float(match.group(1)), float(match.group(2)), float(match.group(3)) if match.group(3) else None
+
+    def read_quicktime_metadata(file_path):
+        # Capture time and GPS from a .mov/.mp4, reading only the moov headers (never mdat):
+        #   moov/mvhd creation time (UTC seconds since 1904), moov/udta/©xyz (ISO 6709 location), and the
+        #   moov/meta keys/ilst pairs Apple devices write (com.apple.quicktime.creationdate / location.ISO6709).
+        found = {}
+        max_read = 65536
+        with open(file_path, "rb") as f:
+            file_end = f.seek(0, os.SEEK_END)
+            for box_type, moov_start, moov_end in read_boxes(f, 0, file_end):
+                if box_type != b"moov":
+                    continue
+                metas = []
+                for child_type, start, end in read_boxes(f, moov_start, moov_end):
+                    if child_type == b"mvhd":
+                        f.seek(start)
+                        data = f.read(12)
+                        if data[:1] == b"\x01":
+                            creation = struct.unpack(">Q", data[4:12])[0]
+                        else:
+                            creation = struct.unpack(">I", data[4:8])[0]
+                        # Zero, garbage or far-future values (anything past 2100) aren't a capture time.
+                        if 2082844800 < creation < 2082844800 + 4102444800:
+                            found["mvhd_time"] = datetime.datetime.fromtimestamp(creation - 2082844800)
+                    elif child_type == b"udta":
+                        for udta_type, udta_start, udta_end in read_boxes(f, start, end):
+                            if udta_type == b"\xa9xyz":
+                                f.seek(udta_start + 4)
+                                location = parse_iso6709(f.read(min(udta_end - udta_start - 4, 256)).decode(errors="replace"))
+                                if location:
+                                    found["location"] = location
+                            elif udta_type == b"meta":
+                                metas.append((udta_start + 4, udta_end))
+                    elif child_type == b"meta":
+                        metas.append((start, end))
+
+                for start, end in metas:
+                    # QuickTime's meta has no version/flags, but the MP4 full-box form does.
+                    f.seek(start)
+                    if f.read(4) == b"\x00\x00\x00\x00":
+                        start += 4
+                    keys = []
+                    items = {}
+                    for meta_type, meta_start, meta_end in read_boxes(f, start, end):
+                        if meta_type == b"keys" and meta_end - meta_start <= max_read:
+                            f.seek(meta_start)
+                            data = f.read(meta_end - meta_start)
+                            pos = 8
+                            for i in range(struct.unpack(">I", data[4:8])[0]):
+                                key_size = struct.unpack(">I", data[pos:pos + 4])[0]
+                                keys.append(data[pos + 8:pos + key_size].decode(errors="replace"))
+                                pos += key_size
+                        elif meta_type == b"ilst" and meta_end - meta_start <= max_read:
+                            for item_type, item_start, item_end in read_boxes(f, meta_start, meta_end):
+                                for data_type, data_start, data_end in read_boxes(f, item_start, item_end):
+                                    if data_type == b"data":
+                                        f.seek(data_start + 8)
+                                        items[struct.unpack(">I", item_type)[0]] = f.read(data_end - data_start - 8)
+                    for index, key in enumerate(keys, 1):
+                        value = items.get(index, b"").decode(errors="replace").strip("\x00 ")
+                        if key == "com.apple.quicktime.creationdate" and value:
+                            found["creationdate"] = value
+                        elif key == "com.apple.quicktime.location.ISO6709" and parse_iso6709(value):
+                            found["location"] = parse_iso6709(value)
+                break
+        return found
 
-        if exif_gps_only and not meta["is_image"]:
-            return meta
+    def parse_xmp_datetime(value):
+        # "2019-01-05T15:03:25.123-08:00" -> (datetime, utc offset or None). Seconds and the offset are optional.
+        # darktable writes exif:DateTimeOriginal in EXIF form instead ("2016:09:11 09:46:11.000").
+        match = re.match(
+            r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d)(?::(\d\d)(?:[.,](\d+))?)?(Z|[+-]\d\d:\d\d)?$", value.strip()
+        )
+        if not match:
+            match = re.match(r"(\d{4}:\d\d:\d\d \d\d:\d\d:\d\d)(?:[.,](\d+))?(Z|[+-]\d\d:\d\d)?$", value.strip())
+            if not match:
+                return None
+            offset = match.group(3)
+            return decode_exif_datetime(match.group(1), match.group(2)), decode_exif_offset("+00:00" if offset == "Z" else offset)
+        year, month, day, hour, minute, second, subsec, offset = match.groups()
+        parsed = decode_exif_datetime(
+            "%s:%s:%s %s:%s:%s" % (year, month, day, hour, minute, second or "00"), subsec
+        )
+        return parsed, decode_exif_offset("+00:00" if offset == "Z" else offset)
+
+    def parse_xmp_coordinate(value):
+        # XMP GPS coordinates are "DDD,MM.mmk" or "DDD,MM,SSk", with k one of N/S/E/W.
+        match = re.match(r"(\d+),(\d+(?:\.\d*)?)(?:,(\d+(?:\.\d*)?))?([NSEW])$", value.strip().upper())
+        if not match:
+            return None
+        degrees = int(match.group(1)) + float(match.group(2)) / 60.0 + float(match.group(3) or 0) / 3600.0
+        return -degrees if match.group(4) in "SW" else degrees
+
+    def read_xmp_sidecar(file_path):
+        # Capture time, camera model, size and GPS from an .xmp sidecar, as meta fields. Lightroom writes the
+        # properties as rdf:Description attributes and darktable as child elements, so both are read.
+        wanted = dict(
+            ("{%s}%s" % (XMP_NAMESPACES[prefix], name), "%s:%s" % (prefix, name))
+            for prefix, names in [
+                ("exif", ["DateTimeOriginal", "PixelXDimension", "PixelYDimension", "GPSLatitude", "GPSLongitude",
+                          "GPSAltitude", "GPSAltitudeRef"]),
+                ("tiff", ["Model", "ImageWidth", "ImageLength"]),
+                ("xmp", ["CreateDate"]),
+                ("photoshop", ["DateCreated"]),
+            ]
+            for name in names
+        )
+        values = {}
+        for event, elem in ElementTree.iterparse(file_path, events=("end",)):
+            for key, value in elem.attrib.items():
+                if key in wanted:
+                    values.setdefault(wanted[key], value)
+            if elem.tag in wanted and elem.text and elem.text.strip():
+                values.setdefault(wanted[elem.tag], elem.text.strip())
+            elem.clear()
+
+        found = {}
+        for key in ["exif:DateTimeOriginal", "photoshop:DateCreated", "xmp:CreateDate"]:
+            try:
+                parsed = parse_xmp_datetime(values.get(key, ""))
+            except ValueError:
+                parsed = None
+            if parsed:
+                found["datetime"], offset = parsed
+                found["exiftime"] = found["datetime"]
+                if offset is not None:
+                    found["utc_offset"] = offset
+                break
+        if values.get("tiff:Model"):
+            found["Camera Model"] = values["tiff:Model"]
+        for width_key, height_key in [("exif:PixelXDimension", "exif:PixelYDimension"), ("tiff:ImageWidth", "tiff:ImageLength")]:
+            if values.get(width_key, "").isdigit() and values.get(height_key, "").isdigit():
+                found["width"] = int(values[width_key])
+                found["height"] = int(values[height_key])
+                break
+        lat = parse_xmp_coordinate(values.get("exif:GPSLatitude", ""))
+        lon = parse_xmp_coordinate(values.get("exif:GPSLongitude", ""))
+        if lat is not None and lon is not None:
+            found["lat"] = lat
+            found["lon"] = lon
+        altitude = re.match(r"(\d+)/(\d+)$", values.get("exif:GPSAltitude", ""))
+        if altitude and int(altitude.group(2)):
+            # Same (numerator, denominator) and ref shape piexif gives.
+            found["altitude"] = (int(altitude.group(1)), int(altitude.group(2)))
+            found["sea_level"] = 1 if values.get("exif:GPSAltitudeRef") == "1" else 0
+        return found
+
+    def record_failure(meta, stage, e):
+        # Which extraction stage failed and why. get_file_metadata saves these in the file cache, so the same
+        # unchanged file isn't put through the failing work again.
+        failures = meta.get("failures", {})
+        failures[stage] = "%s: %s" % (type(e).__name__, e)
+        meta["failures"] = failures
+
+    def device_from_file_name(meta):
+        # Sets meta["device"] (and the capture time, if the device's naming scheme has one) from the file name.
+        device = FILENAME_CLASSIFIER.device(meta["file_name"])
+        if device is None:
+            return False
+        meta["device"] = device
+        # We're just using the local time because we don't know. Try to parse it from the filename.
+        for device, parsed_time in FILENAME_CLASSIFIER.dates(meta["file_name"], only_key=device):
+            meta["datetime"] = parsed_time
+            log_action("Replaced datetime with known time parsing for %s: %s" % (device, meta["datetime"]))
+        return True
+
+    def extract_file_info(meta):
+        # Everything that depends only on the file itself (EXIF, device, capture time, dimensions).
+        # get_file_metadata caches the result, so the second parse_file_list pass doesn't redo it.
+        # This also runs in --workers processes, so it must not touch the brain or other shared state.
+        file_path = meta["file_path"]
+
+        # Images are read once, and piexif, the size probe, PIL and the hasher all work from that buffer.
+        # Big images are mapped for piexif, which only touches the IFDs; the other readers stream the file.
+        buffer = None
+        if meta["is_image"] and file_stat(file_path).size <= IMAGE_BUFFER_BYTES:
+            with open(file_path, "rb") as f:
+                buffer = f.read()
+
+        # A sidecar next to the file is a few KB of XML with the same fields, so it's read first. The file's
+        # own EXIF or QuickTime headers are still parsed whenever the sidecar lacks any field they'd give us,
+        # which includes GPS for most photos, so the sidecar mostly saves exiftool calls, not reads of the file.
+        sidecar = {}
+        if meta.get("sidecar"):
+            try:
+                sidecar = read_xmp_sidecar(meta["sidecar"])
+            except (OSError, ElementTree.ParseError) as e:
+                log_action("Failed to read sidecar %s: %s" % (meta["sidecar"], e))
+                record_failure(meta, "sidecar", e)
 
         # Capture Time.
         meta["datetime"] = None
         # Try to get from exif first.
-        if meta["is_image"]:
+        exif_fields = ["datetime", "Camera Model", "width", "height", "lat", "lon"]
+        quicktime_fields = ["datetime", "lat", "lon"]
+        if meta["is_image"] and not all(field in sidecar for field in exif_fields):
             try:
-                exif = piexif.load(file_path)
+                if buffer is not None:
+                    exif = piexif.load(buffer)
+                else:
+                    # piexif copies everything after a JPEG's headers, so a big JPEG is read from its path, header only.
+                    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                        exif = piexif.load(file_path if data[:2] == b"\xff\xd8" else data)
                 meta["Camera Model"] = exif["0th"][272].decode().replace("\x00", "")
-                meta["datetime"] = datetime.datetime.strptime(exif["0th"][306].decode(), "%Y:%m:%d %H:%M:%S")
-                meta["exiftime"] = datetime.datetime.strptime(exif["0th"][306].decode(), "%Y:%m:%d %H:%M:%S")
+                # SubSecTimeOriginal/OffsetTimeOriginal when DateTime is the original time, else SubSecTime/OffsetTime.
+                exif_ifd = exif.get("Exif", {})
+                if exif_ifd.get(36867) == exif["0th"][306]:
+                    subsec, offset = exif_ifd.get(37521), exif_ifd.get(36881)
+                else:
+                    subsec, offset = exif_ifd.get(37520), exif_ifd.get(36880)
+                meta["datetime"] = decode_exif_datetime(exif["0th"][306], subsec)
+                meta["exiftime"] = meta["datetime"]
+                if decode_exif_offset(offset) is not None:
+                    meta["utc_offset"] = decode_exif_offset(offset)
 
                 try:
                     meta["width"] = int(exif["0th"][256])
@@ -891,125 +2155,342 @@ try:
                 # Or https://exiftool.org/
                 log_action("Falling back to exiftool for %s" % file_path)
                 try:
-                    result = subprocess.run(['exiftool', file_path], stdout=subprocess.PIPE)
-                    exif_dict = {}
-                    for line in result.stdout.decode().split("\n"):
+                    exif_dict = EXIFTOOL_BATCH_RESULTS.pop(file_path, None)
+                    if exif_dict is not None and not all(k in exif_dict for k in [
+                        "Camera Model Name", "Image Width", "Image Height", "Date/Time Original",
+                    ]):
+                        # The batch uses -fast2, which can miss tags a full read of the file finds.
+                        log_action("Batched exiftool result incomplete for %s, reading it on its own" % file_path)
+                        exif_dict = None
+                    if exif_dict is None:
                         try:
-                            k, v = line.split(": ")
-                            exif_dict[k.strip()] = v.strip()
-                        except:
-                            log_action("Skipping %s" % line)
+                            exif_dict = parse_exiftool_output(run_exiftool(file_path))
+                        except OSError as e:
+                            # exiftool is missing, timed out or died, which says nothing about the file.
+                            log_action("exiftool failed on %s: %s" % (file_path, e))
+                            meta["transient_error"] = "%s: %s" % (type(e).__name__, e)
+                            raise
 
                     meta["Camera Model"] = exif_dict["Camera Model Name"]
                     meta["width"] = int(exif_dict['Image Width'])
                     meta["height"] = int(exif_dict['Image Height'])
-                    meta["datetime"] = datetime.datetime.strptime(exif_dict["Date/Time Original"].split(".")[0], "%Y:%m:%d %H:%M:%S")
-                    meta["exiftime"] = datetime.datetime.strptime(exif_dict["Date/Time Original"].split(".")[0], "%Y:%m:%d %H:%M:%S")
+                    meta["datetime"] = decode_exif_datetime(
+                        exif_dict["Date/Time Original"].split(".")[0], exif_dict.get("Sub Sec Time Original")
+                    )
+                    meta["exiftime"] = meta["datetime"]
+                    if decode_exif_offset(exif_dict.get("Offset Time Original")) is not None:
+                        meta["utc_offset"] = decode_exif_offset(exif_dict.get("Offset Time Original"))
                 except Exception as e:
                     # pprint(exif_dict)
-                    device_found = False
-                    for device, r in DEVICE_REGEXES.items():
-                        matches = re.findall(r, meta["file_name"])
-                        if matches:
-                            meta["device"] = device
-                            device_found = True
-                        break
-
-                    for substring, device in DEVICE_SUBSTRINGS.items():
-                        if substring in file_path.split("/")[-1]:
-                            meta["device"] = device
-                            device_found = True
-                            break
-
-                    if device_found:
-                        # We're just using the local time because we don't know. Try to parse it from the filename.
-                        if device in DATE_FORMAT_PATTERNS and device in DATE_PARSERS:
-                            try:
-                                matches = re.findall(DATE_PARSERS[device], meta["file_name"])
-                                if matches:
-                                    parsed_time = datetime.datetime.strptime(matches[0], DATE_FORMAT_PATTERNS[device])
-                                    meta["datetime"] = parsed_time
-                                    log_action("Replaced datetime with known time parsing for %s: %s" % (device, meta["datetime"]))
-                            except ValueError:
-                                # Rarely, a file will start with a match, but it's really just a random assortment of hex.
-                                pass
-                            except Exception as e:
-                                print(device)
-                                print(DATE_FORMAT_PATTERNS[device])
-                                print(matches)
-                                print(matches[0])
-                                raise e
-                    else:
+                    if not device_from_file_name(meta) and not ("datetime" in sidecar and "Camera Model" in sidecar):
                         log_action("Failed to extract any EXIF or find device match from %s" % file_path)
                         log_action("Exif: %s" % exif_dict)
                         meta["error"] = "❗Failed to extract any EXIF."
+                        if "transient_error" not in meta:
+                            # Only when exiftool actually ran and rejected the file.
+                            record_failure(meta, "exif", e)
                         # raise e
             # print("extracted EXIF")
             # print(meta)
 
-        else:
-            if exif_gps_only:
-                return meta
-
-            device_found = False
-            for device, r in DEVICE_REGEXES.items():
-                matches = re.findall(r, meta["file_name"])
-                if matches:
-                    meta["device"] = device
-                    device_found = True
-                break
-
-            for substring, device in DEVICE_SUBSTRINGS.items():
-                if substring in file_path.split("/")[-1]:
-                    meta["device"] = device
-                    device_found = True
-                    break
+        elif not meta["is_image"]:
+            device_from_file_name(meta)
 
-            if device_found:
-                # print("found device: %s" % device)
-                # We're just using the local time because we don't know. Try to parse it from the filename.
-                if device in DATE_FORMAT_PATTERNS and device in DATE_PARSERS:
+            if meta["extension"].lower() in ["mov", "mp4", "m4v"] and not all(field in sidecar for field in quicktime_fields):
+                try:
+                    quicktime = read_quicktime_metadata(file_path)
+                except (OSError, struct.error, ValueError, OverflowError) as e:
+                    log_action("Failed to read QuickTime metadata from %s: %s" % (file_path, e))
+                    quicktime = {}
+                if "location" in quicktime:
+                    meta["lat"], meta["lon"], altitude = quicktime["location"]
+                    if altitude is not None:
+                        meta["altitude"] = altitude
+                if "creationdate" in quicktime:
+                    # Local wall-clock time plus offset, e.g. 2019-01-05T15:03:25-0800, so it beats the file name.
                     try:
-                        matches = re.findall(DATE_PARSERS[device], meta["file_name"])
-                        if matches:
-                            parsed_time = datetime.datetime.strptime(matches[0], DATE_FORMAT_PATTERNS[device])
-                            meta["datetime"] = parsed_time
-                            log_action("Replaced datetime with known time parsing for %s: %s" % (device, meta["datetime"]))
+                        meta["datetime"] = datetime.datetime.strptime(quicktime["creationdate"][:19], "%Y-%m-%dT%H:%M:%S")
+                        meta["exiftime"] = meta["datetime"]
+                        offset = quicktime["creationdate"][19:]
+                        if len(offset) == 5:
+                            offset = offset[:3] + ":" + offset[3:]
+                        if decode_exif_offset(offset) is not None:
+                            meta["utc_offset"] = decode_exif_offset(offset)
                     except ValueError:
-                        # Rarely, a file will start with a match, but it's really just a random assortment of hex.
                         pass
-                    except Exception as e:
-                        print(device)
-                        print(DATE_FORMAT_PATTERNS[device])
-                        print(matches)
-                        print(matches[0])
-                        raise e
-
+                if not meta["datetime"] and "mvhd_time" in quicktime:
+                    # mvhd is UTC by the spec (some cameras write local time), so it only fills in for the file name.
+                    meta["datetime"] = quicktime["mvhd_time"]
+                    meta["exiftime"] = meta["datetime"]
 
-        meta["mtime"] = datetime.datetime.fromtimestamp(os.path.getmtime(file_path))
+        meta.update(sidecar)
+        meta["mtime"] = datetime.datetime.fromtimestamp(file_stat(file_path).mtime_ns / 1e9)
 
         if "datetime" not in meta or not meta["datetime"]:
             # Try to parse out the date from the filename
-            for device, pattern in DATE_FORMAT_PATTERNS.items():
-                try:
-                    matches = re.findall(DATE_PARSERS[device], meta["file_name"])
-                    if matches:
-                        parsed_time = datetime.datetime.strptime(matches[0], DATE_FORMAT_PATTERNS[device])
-                        meta["datetime"] = parsed_time
-                        log_action("Replaced datetime with known time parsing for %s: %s" % (device, meta["datetime"]))
-                except ValueError:
-                    # Rarely, a file will start with a match, but it's really just a random assortment of hex.
-                    pass
-                except Exception as e:
-                    print(device)
-                    print(DATE_FORMAT_PATTERNS[device])
-                    print(matches)
-                    print(matches[0])
-                    raise e
+            for device, parsed_time in FILENAME_CLASSIFIER.dates(meta["file_name"]):
+                meta["datetime"] = parsed_time
+                log_action("Replaced datetime with known time parsing for %s: %s" % (device, meta["datetime"]))
 
         # That failed too?  Just use file modification time and hope for the best.
         if "datetime" not in meta or not meta["datetime"]:
-            meta["datetime"] = meta["mtime"]
+            # Whole seconds, so only a real SubSecTime puts milliseconds in the name.
+            meta["datetime"] = meta["mtime"].replace(microsecond=0)
+
+        try:
+            if meta["is_image"] and "width" not in meta:
+                try:
+                    size = probe_image_size(file_path, buffer)
+                except (struct.error, IndexError, ValueError):
+                    # Truncated or malformed header; PIL gets the final say.
+                    size = None
+                if size is None:
+                    with Image.open(io.BytesIO(buffer) if buffer is not None else file_path) as im:
+                        size = im.size
+                meta["width"] = int(size[0])
+                meta["height"] = int(size[1])
+        except OSError as e:
+            # UnidentifiedImageError, or a truncated file PIL gives up on while reading the header.
+            log_action("Failed to read image at %s. It might be corrupt, please check and try again." % file_path)
+            meta["failed"] = "❗Failed to read image at %s. It might be corrupt, please check and try again."
+            record_failure(meta, "decode", e)
+            return meta
+
+        if meta["is_image"]:
+            # Hashed now, while the file is in memory. get_file_metadata moves these to the file cache.
+            try:
+                meta["imagehashes"] = image_hashes(file_path, buffer)
+            except Exception as e:
+                # The second pass falls back to a file hash.
+                record_failure(meta, "imagehashes", e)
+
+        return meta
+
+    def extract_file_info_worker(meta, f_stat, exiftool_result=None):
+        # Runs in a --workers process. Log lines are handed back so the coordinator can add them in order.
+        global action_log
+        action_log = ""
+        FILE_STATS[meta["file_path"]] = f_stat
+        if exiftool_result is not None:
+            EXIFTOOL_BATCH_RESULTS[meta["file_path"]] = exiftool_result
+        try:
+            extract_file_info(meta)
+        finally:
+            FILE_STATS.pop(meta["file_path"], None)
+            EXIFTOOL_BATCH_RESULTS.pop(meta["file_path"], None)
+        return meta, action_log
+
+    def new_file_meta(file_path):
+        meta = FileRecord()
+        # Get file type from extension (which we trust, because why not. I'm not sniffing headers for this.)
+        extension = file_path.split(".")[-1]
+        meta["file_path"] = file_path
+        meta["relative_file_path"] = relative_file_path(file_path)
+        meta["extension"] = extension
+        meta["source_name"] = file_path.split("/")[-1]
+        meta["file_name"] = file_path.split("/")[-1]
+        meta["is_image"] = extension.lower() in IMAGE_EXTENSIONS
+        sidecar = find_sidecar(file_path)
+        if sidecar is not None:
+            meta["sidecar"] = sidecar[0]
+        return meta
+
+    def submit_file_work(pool, file_path, exif_gps_only, wait=True):
+        # Starts the per-file work get_file_metadata is about to need for file_path on a worker. Each piece of
+        # work holds one of its device's DEVICE_JOBS slots until it finishes. With wait=False, returns False
+        # instead of waiting for a slot; calling again later submits whatever is still missing.
+        if ignored(file_path) or file_stat(file_path).size == 0:
+            return True
+        semaphore = device_semaphore(file_stat(file_path).dev)
+        is_image = file_path.split(".")[-1].lower() in IMAGE_EXTENSIONS
+        if file_path not in PENDING_FILE_INFO and cached_file_info(file_path) is None:
+            if is_image or not exif_gps_only:
+                if not semaphore.acquire(blocking=wait):
+                    return False
+                PENDING_FILE_INFO[file_path] = pool.submit(
+                    extract_file_info_worker, new_file_meta(file_path), file_stat(file_path),
+                    EXIFTOOL_BATCH_RESULTS.pop(file_path, None),
+                )
+                PENDING_FILE_INFO[file_path].add_done_callback(lambda future: semaphore.release())
+        if (
+            is_image and not exif_gps_only and file_path not in PENDING_IMAGE_HASHES and
+            "failed" not in CACHED_FILE_INFO.get(file_path, {}) and
+            "imagehashes" not in (file_cache_entry(file_path) or {}) and
+            "imagehashes" not in (file_cache_entry(file_path) or {}).get("failures", {})
+        ):
+            if not semaphore.acquire(blocking=wait):
+                return False
+            PENDING_IMAGE_HASHES[file_path] = pool.submit(image_hashes, file_path)
+            PENDING_IMAGE_HASHES[file_path].add_done_callback(lambda future: semaphore.release())
+        return True
+
+    def iter_with_workers(file_list, exif_gps_only, sources=None):
+        # Yields file_list unchanged, in order, while worker processes extract and hash the files ahead of it.
+        # sources is the StreamingFileList file_list comes from, if any.
+        if METADATA_WORKERS <= 1:
+            for file_path in file_list:
+                yield file_path
+            return
+
+        lookahead = METADATA_WORKERS * METADATA_LOOKAHEAD_PER_WORKER
+        window = collections.deque()
+        parts = sources.parts if sources is not None else []
+        # The source the latest file came from, how many files came before it, and how far each later source
+        # has been read ahead.
+        current_part = 0
+        before_part = 0
+        taken = 0
+        ahead = [0] * len(parts)
+        with ProcessPoolExecutor(max_workers=METADATA_WORKERS, mp_context=multiprocessing.get_context("spawn")) as pool:
+            try:
+                for file_path in file_list:
+                    submit_file_work(pool, file_path, exif_gps_only)
+                    window.append(file_path)
+
+                    # Later sources are usually other cards or disks, so their first files are read now rather
+                    # than when their turn comes. Their devices' DEVICE_JOBS limits still apply.
+                    taken += 1
+                    while current_part < len(parts) - 1 and taken > before_part + len(parts[current_part]):
+                        before_part += len(parts[current_part])
+                        current_part += 1
+                    for part in range(current_part + 1, len(parts)):
+                        while ahead[part] < min(len(parts[part]), lookahead):
+                            if not submit_file_work(pool, parts[part][ahead[part]], exif_gps_only, wait=False):
+                                break
+                            ahead[part] += 1
+
+                    if len(window) > lookahead:
+                        yield window.popleft()
+                while window:
+                    yield window.popleft()
+            finally:
+                # Anything not consumed (e.g. after an error) is dropped rather than left half-done.
+                for futures in (PENDING_FILE_INFO, PENDING_IMAGE_HASHES):
+                    for future in futures.values():
+                        future.cancel()
+                    futures.clear()
+
+    def physical_location(file_path):
+        # Sort key for where the file's data starts on disk: the first extent from FIEMAP where the filesystem
+        # supports it, otherwise the inode number, which most filesystems allocate roughly in disk order.
+        if file_path in PHYSICAL_LOCATIONS:
+            return PHYSICAL_LOCATIONS[file_path]
+        PHYSICAL_LOCATIONS[file_path] = location = find_physical_location(file_path)
+        return location
+
+    def find_physical_location(file_path):
+        f_stat = file_stat(file_path)
+        if f_stat.dev not in FIEMAP_UNSUPPORTED:
+            # struct fiemap asking for one extent, followed by room for that struct fiemap_extent.
+            request = bytearray(struct.pack("=QQIIII", 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0) + b"\x00" * 56)
+            try:
+                with open(file_path, "rb") as f:
+                    fcntl.ioctl(f.fileno(), FS_IOC_FIEMAP, request)
+                # Skip extents not placed on disk yet (FIEMAP_EXTENT_UNKNOWN, FIEMAP_EXTENT_DELALLOC).
+                if struct.unpack_from("=I", request, 20)[0] and not struct.unpack_from("=I", request, 72)[0] & 0x6:
+                    return (f_stat.dev, 0, struct.unpack_from("=Q", request, 40)[0])
+            except OSError as e:
+                if e.errno in (errno.ENOTTY, errno.EOPNOTSUPP, errno.EINVAL):
+                    FIEMAP_UNSUPPORTED.add(f_stat.dev)
+        return (f_stat.dev, 1, f_stat.ino)
+
+    def needs_prefetch(file_path):
+        # Images extract_file_info is about to read in full. Videos only have their headers read, so they're left alone.
+        return (
+            file_path.split(".")[-1].lower() in IMAGE_EXTENSIONS and not ignored(file_path) and
+            file_stat(file_path).size > 0 and cached_file_info(file_path) is None and file_path not in PENDING_FILE_INFO
+        )
+
+    def warm_file(file_path):
+        try:
+            with device_semaphore(file_stat(file_path).dev):
+                with open(file_path, "rb") as f:
+                    while f.read(1048576):
+                        pass
+        except OSError:
+            pass
+
+    def prefetch_file(file_path):
+        # Starts file_path on its way into the OS cache without waiting for it.
+        global PREFETCH_POOL
+        if hasattr(os, "posix_fadvise"):
+            try:
+                fd = os.open(file_path, os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fd)
+            except OSError:
+                pass
+        else:
+            if PREFETCH_POOL is None:
+                PREFETCH_POOL = ThreadPoolExecutor(max_workers=1)
+                atexit.register(PREFETCH_POOL.shutdown, wait=False)
+            PREFETCH_POOL.submit(warm_file, file_path)
+
+    def iter_with_prefetch(file_list):
+        # Yields file_list unchanged, in order, after starting reads for up to PREFETCH_FILES files (and
+        # PREFETCH_BYTES) ahead, so the disk works on the next images while the current one is decoded.
+        if PREFETCH_FILES <= 0:
+            for file_path in file_list:
+                yield file_path
+            return
+
+        window = collections.deque()
+        window_bytes = 0
+        for file_path in file_list:
+            size = file_stat(file_path).size if needs_prefetch(file_path) else 0
+            while window and (len(window) >= PREFETCH_FILES or window_bytes + size > PREFETCH_BYTES):
+                done_path, done_size = window.popleft()
+                window_bytes -= done_size
+                yield done_path
+            if size:
+                prefetch_file(file_path)
+            window.append((file_path, size))
+            window_bytes += size
+        while window:
+            yield window.popleft()[0]
+
+    def get_image_hashes(file_path):
+        entry = file_cache_entry(file_path, create=True)
+        if "imagehashes" in entry.get("failures", {}):
+            PENDING_IMAGE_HASHES.pop(file_path, None)
+            raise Exception("Image hashing already failed for this file: %s" % entry["failures"]["imagehashes"])
+        if "imagehashes" not in entry:
+            try:
+                if file_path in PENDING_IMAGE_HASHES:
+                    entry["imagehashes"] = PENDING_IMAGE_HASHES.pop(file_path).result()
+                else:
+                    entry["imagehashes"] = image_hashes(file_path)
+            except Exception as e:
+                entry.setdefault("failures", {})["imagehashes"] = "%s: %s" % (type(e).__name__, e)
+                raise
+        return list(entry["imagehashes"])
+
+    def get_file_metadata(file_path, exif_gps_only=False):
+        global ARGS
+        global action_log
+        error_str = None
+        meta = new_file_meta(file_path)
+
+        if exif_gps_only:
+            log_action("Checked %s." % meta["relative_file_path"])
+
+        if exif_gps_only and not meta["is_image"]:
+            return meta
+
+        if cached_file_info(file_path) is not None:
+            meta.update(CACHED_FILE_INFO[file_path])
+        elif file_path in PENDING_FILE_INFO:
+            extracted, worker_log = PENDING_FILE_INFO.pop(file_path).result()
+            with ACTION_LOG_LOCK:
+                action_log += worker_log
+            meta.update(extracted)
+            remember_file_info(file_path, meta)
+        else:
+            extract_file_info(meta)
+            remember_file_info(file_path, meta)
+            EXIFTOOL_BATCH_RESULTS.pop(file_path, None)
 
         # Device it was captured on
         if "Camera Model" in meta:
@@ -1025,15 +2506,7 @@ try:
                 DEVICE_DISPLAYNAME_MAPPINGS[camera_key] = meta["Camera Model"]
                 meta["device"] = CAMERA_MODEL_MAPPINGS[meta["Camera Model"]]
 
-        try:
-            if meta["is_image"] and "width" not in meta:
-                with Image.open(file_path) as im:
-                    meta["width"], meta["height"] = im.size
-                    meta["width"] = int(meta["width"])
-                    meta["height"] = int(meta["height"])
-        except UnidentifiedImageError:
-            log_action("Failed to read image at %s. It might be corrupt, please check and try again." % file_path)
-            meta["failed"] = "❗Failed to read image at %s. It might be corrupt, please check and try again."
+        if "failed" in meta:
             return meta
 
         meta["person"] = "steven"
@@ -1308,6 +2781,9 @@ try:
             meta["datetime"].minute,
             meta["datetime"].second,
         )
+        if meta["datetime"].microsecond:
+            # Sub-second EXIF time, so a burst doesn't all land on the same second.
+            meta["datetimestr"] += "-%03d" % (meta["datetime"].microsecond // 1000)
         meta["mtimestr"] = "%s_%02d-%02d-%02d" % (
             meta["mtime"].strftime("%Y-%m-%d"),
             meta["mtime"].hour,
@@ -1327,7 +2803,7 @@ try:
 
         # Do cleanup on ones that were somehow mucked up.
         if needed_cleanup:
-            meta['cleaned_name'] = re.sub(r"\A%s-\d\d-\d\d_\d\d-\d\d-\d\d_" % meta["datetime"].year, '', meta['cleaned_name'])
+            meta['cleaned_name'] = re.sub(r"\A%s-\d\d-\d\d_\d\d-\d\d-\d\d(-\d\d\d)?_" % meta["datetime"].year, '', meta['cleaned_name'])
 
         meta["person"] = "steven"
         if "edna" in meta["device"]:
@@ -1346,7 +2822,7 @@ try:
         if not exif_gps_only:
             if meta["is_image"]:
                 try:
-                    meta["imagehashes"] = image_hashes(file_path)
+                    meta["imagehashes"] = get_image_hashes(file_path)
 
                     lowest_distance = 9999999
                     lowest_hash = None
@@ -1434,14 +2910,14 @@ try:
                     # raise e
 
             if "imagehashes" not in meta:
-                meta["filesize"] = os.path.getsize(meta["file_path"])
+                meta["filesize"] = file_stat(meta["file_path"]).size
                 namesize_hash = "file%s" % meta["filesize"]
                 if namesize_hash in brain["imagehashes"]:
                     # File size match. We're going to have to compare MD5s
                     if "md5" not in brain["imagehashes"][namesize_hash]:
-                        brain["imagehashes"][namesize_hash]["md5"] = md5_file(brain["imagehashes"][namesize_hash]["file_path"])
+                        brain["imagehashes"][namesize_hash]["md5"] = cached_md5(brain["imagehashes"][namesize_hash]["file_path"])
 
-                    meta["md5"] = md5_file(meta["file_path"])
+                    meta["md5"] = cached_md5(meta["file_path"])
 
                     if meta["md5"] != brain["imagehashes"][namesize_hash]["md5"]:
                         # We have mismatching files.
@@ -1474,18 +2950,16 @@ try:
         global IMPORT_DIR
         if len(file_list) > 0 and "no such file or directory" not in file_list[0].lower():
             counter = 1
-            total = len(file_list)
-            total_size = 0
-            size_copied = 0
-            start_time = datetime.datetime.now()
-            for file_path in file_list:
-                if not ignored(file_path):
-                    total_size += os.path.getsize(file_path)
-
-            for file_path in file_list:
+            file_iter = iter_with_prefetch(iter_with_exiftool_batches(file_list))
+            sources = file_list if isinstance(file_list, StreamingFileList) else None
+            for file_path in iter_with_workers(file_iter, exif_gps_only, sources):
                 write_temp_brain()
                 meta = None
-                if not ignored(file_path) and os.path.getsize(file_path) > 0:
+                if not ignored(file_path) and file_stat(file_path).size > 0:
+                    if isinstance(file_list, StreamingFileList):
+                        total = file_list.progress_total()
+                    else:
+                        total = len(file_list)
 
                     sys.stdout.write("\r Checking %s... (%s/%s)" % (
                         file_path.split("/")[-1], counter, total,
@@ -1595,17 +3069,21 @@ try:
         total_size = 0
         size_copied = 0
         start_time = datetime.datetime.now()
-        files_to_copy = []
-        files_copied = []
-        for imagehash, meta in imagehash_list.items():
+        # A record can be filed under several rotation hashes; each file is counted and copied once.
+        files_to_copy = set()
+        files_copied = set()
+        copy_order = [item for item in imagehash_list.items() if not ignored(item[1]["file_path"])]
+        if ARGS.physical_order:
+            copy_order.sort(key=lambda item: physical_location(item[1]["file_path"]))
+        for imagehash, meta in copy_order:
             if not ignored(meta["file_path"]) and meta["file_path"] not in files_to_copy:
-                total_size += os.path.getsize(meta["file_path"])
-                files_to_copy.append(meta["file_path"])
+                total_size += file_stat(meta["file_path"]).size
+                files_to_copy.add(meta["file_path"])
 
-        for imagehash, meta in imagehash_list.items():
+        for imagehash, meta in copy_order:
             if not ignored(meta["file_path"]) and meta["file_path"] not in files_copied:
                 file_path = meta["file_path"]
-                current_file_size = os.path.getsize(file_path)
+                current_file_size = file_stat(file_path).size
                 sys.stdout.write("\r Checking %s... (%s/%s) %s/%s (%.1f %%) %s ETA" % (
                     meta["relative_file_path"], counter, total,
                     sizeof_fmt(size_copied), sizeof_fmt(total_size),
@@ -1631,7 +3109,11 @@ try:
                 pathlib.Path(file_import_dir).mkdir(parents=True, exist_ok=True)
                 dest_file = os.path.join(file_import_dir, meta["canonical_name"])
 
-                if not os.path.isfile(dest_file) or os.path.getsize(file_path) != os.path.getsize(dest_file):
+                try:
+                    dest_size = os.stat(dest_file).st_size
+                except OSError:
+                    dest_size = None
+                if dest_size != current_file_size:
                     sys.stdout.write("\r Importing %s... (%s/%s) %s/%s (%.1f %%) %s ETA" % (
                         meta["relative_file_path"], counter, total,
                         sizeof_fmt(size_copied), sizeof_fmt(total_size),
@@ -1659,35 +3141,284 @@ try:
                     sys.stdout.flush()
                     counter += 1
                 size_copied += current_file_size
-                files_copied.append(meta["file_path"])
+                files_copied.add(meta["file_path"])
+
 
+    def read_files_from(files_from, source_dirs):
+        # Reads a NUL- or newline-delimited list of paths (e.g. from `find -print0`), or stdin for "-". Relative
+        # paths (`cd /card && find . -newer ...`) are under the source directory, so they need exactly one.
+        if files_from == "-":
+            data = sys.stdin.buffer.read()
+        else:
+            with open(files_from, 'rb') as f:
+                data = f.read()
+        if b"\0" in data:
+            entries = data.split(b"\0")
+        else:
+            entries = data.splitlines()
+
+        file_list = []
+        listed = set()
+        seen_files = {}
+        for entry in entries:
+            file_path = os.fsdecode(entry)
+            if file_path and not os.path.isabs(file_path):
+                if len(source_dirs) != 1:
+                    log_action("Skipping relative path %s listed in %s, which of the %s sources is it under?" % (
+                        file_path, files_from, len(source_dirs),
+                    ))
+                    continue
+                file_path = os.path.normpath(os.path.join(source_dirs[0], file_path))
+            if not file_path or file_path in listed:
+                continue
+            listed.add(file_path)
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                st = None
+            if st is not None and stat.S_ISREG(st.st_mode):
+                f_stat = make_file_stat(st)
+                # The same file listed under two paths (hard links, symlinks) is only imported once, as in discovery.
+                kept_path = seen_files.setdefault((f_stat.dev, f_stat.ino), file_path)
+                if kept_path != file_path:
+                    aliases = FILE_ALIASES.setdefault(kept_path, [])
+                    if file_path not in aliases:
+                        aliases.append(file_path)
+                        log_action("Skipping %s, same file as %s" % (file_path, kept_path))
+                    continue
+                if not filtered_out(file_path, f_stat):
+                    FILE_STATS[file_path] = f_stat
+                    file_list.append(file_path)
+            else:
+                log_action("Could not find file %s listed in %s" % (file_path, files_from))
+        return file_list
 
     def pull_files(args):
-        print("\nImporting from %s..." % args.source_dir)
+        print("\nImporting from %s..." % ", ".join(args.source_dirs))
 
-        # Get default Camera images
-        if os.path.isdir(args.source_dir):
-            sys.stdout.write("\nGetting file list...")
-            file_list = get_local_file_list(args.source_dir)
-            sys.stdout.write("done.\n")
+        if args.files_from:
+            # The caller already knows which files are new, so skip the walk and only copy those.
+            sys.stdout.write("\nReading file list from %s..." % args.files_from)
+            file_list = read_files_from(args.files_from, args.source_dirs)
+            sys.stdout.write("done. (%s files)\n" % len(file_list))
             sys.stdout.flush()
+            import_new_files(args, file_list)
 
-            log_action("\nChecking for EXIF-based GPS information, and auto-tagging dates.")
-            print("\nChecking for EXIF-based GPS information, and auto-tagging dates....")
-            parse_file_list(args.source_dir, file_list, exif_gps_only=True)
-            
-            log_action("\nChecking for duplicates, verifying location, and deciding on the canonical copy.")
-            print("\nChecking for duplicates, verifying location, and deciding on the canonical copy....")
-            parse_file_list(args.source_dir, file_list, exif_gps_only=False)
+        else:
+            source_dirs = []
+            for source_dir in args.source_dirs:
+                if os.path.isdir(source_dir):
+                    source_dirs.append(source_dir)
+                else:
+                    print("❌ %s empty or not found." % (source_dir,))
+            # A source inside another one would only find the same files again, in whichever walk got there first.
+            real_dirs = dict((source_dir, os.path.join(os.path.realpath(source_dir), "")) for source_dir in source_dirs)
+            for source_dir in list(source_dirs):
+                for other_dir in source_dirs:
+                    if other_dir != source_dir and real_dirs[source_dir].startswith(real_dirs[other_dir]) and (
+                        real_dirs[source_dir] != real_dirs[other_dir] or source_dirs.index(other_dir) < source_dirs.index(source_dir)
+                    ):
+                        print("✔ Skipping %s, already inside %s." % (source_dir, other_dir))
+                        source_dirs.remove(source_dir)
+                        break
+            if not source_dirs:
+                return
+
+            # Every source is walked at the same time, limited per device by DEVICE_JOBS.
+            load_scan_index()
+            seen_files = {}
+            file_list = StreamingFileList(*[
+                iter_local_files(source_dir, full_rescan=args.full_rescan, dots=args.no_streaming, seen_files=seen_files)
+                for source_dir in source_dirs
+            ])
+            if args.no_streaming:
+                sys.stdout.write("\nGetting file list...")
+                file_list = list(file_list)
+                sys.stdout.write("done.\n")
+            else:
+                # Files are checked while the rest of the tree is still being listed.
+                sys.stdout.write("\nStreaming file list...\n")
+            sys.stdout.flush()
+
+            check_file_list(", ".join(source_dirs), file_list)
 
             log_action("\nCopying files.")
             print("\nCopying files...")
             copy_files(brain["imagehashes"], dry_run=args.dry_run)
 
+    def check_file_list(source_dir, file_list):
+        if ARGS.physical_order:
+            sys.stdout.write("\nSorting files by position on disk...")
+            sys.stdout.flush()
+            # Ignored files and cache hits aren't read, so they go first and only the rest are located.
+            skipped = []
+            to_read = []
+            for file_path in file_list:
+                if ignored(file_path) or cached_file_info(file_path) is not None:
+                    skipped.append(file_path)
+                else:
+                    to_read.append(file_path)
+            file_list = skipped + sorted(to_read, key=physical_location)
+            sys.stdout.write("done. (%s files, %s to read)\n" % (len(file_list), len(to_read)))
+
+        log_action("\nChecking for EXIF-based GPS information, and auto-tagging dates.")
+        print("\nChecking for EXIF-based GPS information, and auto-tagging dates....")
+        parse_file_list(source_dir, file_list, exif_gps_only=True)
+
+        log_action("\nChecking for duplicates, verifying location, and deciding on the canonical copy.")
+        print("\nChecking for duplicates, verifying location, and deciding on the canonical copy....")
+        parse_file_list(source_dir, file_list, exif_gps_only=False)
+
+    def import_new_files(args, file_list):
+        # Runs just these files through metadata, dedup and copy against the in-memory brain.
+        check_file_list(", ".join(args.source_dirs), file_list)
+
+        new_files = set(file_list)
+        log_action("\nCopying files.")
+        print("\nCopying files...")
+        copy_files(
+            dict((h, meta) for h, meta in brain["imagehashes"].items() if meta["file_path"] in new_files),
+            dry_run=args.dry_run,
+        )
+
+    def add_watches(inotify, top, watched_dirs):
+        # Watches top and every directory below it, following symlinks but never the same directory twice.
+        # Directories that disappear or can't be watched are skipped. Running out of watches (ENOSPC, see
+        # fs.inotify.max_user_watches) is raised, so watch_source can fall back to polling.
+        for dirpath, dirnames, filenames in os.walk(top, followlinks=True):
+            try:
+                dir_stat = os.stat(dirpath)
+            except OSError as e:
+                log_action("Not watching %s: %s" % (dirpath, e))
+                dirnames[:] = []
+                continue
+            dir_id = (dir_stat.st_dev, dir_stat.st_ino)
+            if dir_id in watched_dirs:
+                dirnames[:] = []
+                continue
+            watched_dirs.add(dir_id)
+            dirnames[:] = [d for d in dirnames if not ignored_dir(os.path.join(dirpath, d))]
+            try:
+                inotify.add_watch(dirpath)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise
+                log_action("Not watching %s: %s" % (dirpath, e))
+
+    def stop_inotify(inotify, e):
+        # Out of inotify watches; --watch carries on by polling.
+        log_action("Switching to polling, could not add inotify watches: %s" % e)
+        print("\nRan out of inotify watches (%s), polling every %ss instead." % (e, WATCH_POLL_SECONDS))
+        inotify.close()
+
+    def watch_source(args):
+        # Imports files as they arrive under source_dir, until interrupted with Ctrl-C.
+        # A file is only picked up once it has been quiet for WATCH_SETTLE_SECONDS with an unchanged size,
+        # so half-synced files aren't imported.
+        inotify = None
+        if Inotify.available():
+            inotify = Inotify()
+            watched_dirs = set()
+            try:
+                for source_dir in args.source_dirs:
+                    add_watches(inotify, source_dir, watched_dirs)
+            except OSError as e:
+                stop_inotify(inotify, e)
+                inotify = None
+        if inotify:
+            print("\nWatching %s for new files (inotify). Press Ctrl-C to stop." % ", ".join(args.source_dirs))
+        else:
+            print("\nWatching %s for new files (polling every %ss). Press Ctrl-C to stop." % (
+                ", ".join(args.source_dirs), WATCH_POLL_SECONDS,
+            ))
+
+        known = dict((path, FILE_STATS[path]) for path in FILE_STATS)
+        pending = {}
+        try:
+            while True:
+                changed = []
+                if inotify:
+                    for path, mask in inotify.read_events(WATCH_SETTLE_SECONDS):
+                        if path is None:
+                            # The event queue overflowed, so rescan for anything we missed.
+                            for source_dir in args.source_dirs:
+                                changed.extend(get_local_file_list(source_dir))
+                        elif mask & Inotify.IN_ISDIR:
+                            if not ignored_dir(path):
+                                if inotify:
+                                    try:
+                                        add_watches(inotify, path, watched_dirs)
+                                    except OSError as e:
+                                        stop_inotify(inotify, e)
+                                        inotify = None
+                                changed.extend(get_local_file_list(path))
+                        else:
+                            # The file may have been rewritten since discovery stat'ed it.
+                            FILE_STATS.pop(path, None)
+                            changed.append(path)
+                else:
+                    time.sleep(WATCH_POLL_SECONDS)
+                    for source_dir in args.source_dirs:
+                        changed.extend(get_local_file_list(source_dir))
+
+                now = time.time()
+                for path in changed:
+                    if path.lower().endswith(".xmp"):
+                        # New or re-saved sidecars apply to images imported after them.
+                        try:
+                            register_sidecars([(path, file_stat(path))])
+                        except OSError:
+                            SIDECARS.pop((os.path.dirname(path), os.path.basename(path)[:-4].lower()), None)
+                    if ignored(path):
+                        continue
+                    try:
+                        current = file_stat(path)
+                    except OSError:
+                        continue
+                    if filtered_out(path, current):
+                        continue
+                    # Polling lists pending files again every time; only a change restarts their settle time.
+                    if known.get(path) != current and (path not in pending or pending[path][1] != current):
+                        pending[path] = (now, current)
+
+                ready = []
+                for path, (last_seen, pending_stat) in list(pending.items()):
+                    if now - last_seen < WATCH_SETTLE_SECONDS:
+                        continue
+                    FILE_STATS.pop(path, None)
+                    try:
+                        current = file_stat(path)
+                    except OSError:
+                        del pending[path]
+                        continue
+                    if current != pending_stat:
+                        pending[path] = (now, current)
+                    else:
+                        del pending[path]
+                        known[path] = current
+                        # A rewritten file has to be read again.
+                        CACHED_FILE_INFO.pop(path, None)
+                        ready.append(path)
+
+                if ready:
+                    print("\n%s new file(s)." % len(ready))
+                    import_new_files(args, ready)
+                    with open('importamator.db', "w+b") as f:
+                        pickle.dump(brain, f)
+        except KeyboardInterrupt:
+            print("\nStopped watching %s." % ", ".join(args.source_dirs))
+        finally:
+            if inotify:
+                inotify.close()
+
 
     def write_import_log():
         with open('import-%s.log' % now_str, "w+") as f:
             f.write(action_log)
+            if FILE_ALIASES != {}:
+                f.write("\n Files found through more than one path:")
+                for file_path, aliases in FILE_ALIASES.items():
+                    f.write("\n%s\n  also at %s" % (file_path, "\n  also at ".join(aliases)))
             if EXTRA_CAMERA_MAPPINGS != {}:
                 f.write("\n Autogenerated Missing Camera Mappings:")
                 print("\n Autogenerated Missing Camera Mappings:")
@@ -1697,6 +3428,20 @@ try:
             print(" - import-%s.log" % now_str)
 
 
+    def report_failures():
+        # Files from this run that failed an extraction stage, now or on an earlier run with the file unchanged.
+        failed = []
+        for file_path in sorted(FILE_STATS):
+            entry = file_cache_entry(file_path)
+            if entry is not None and entry.get("failures"):
+                failed.append((file_path, entry["failures"]))
+        log_action("\nFiles that failed extraction (%s):" % len(failed))
+        print("\nFiles that failed extraction (%s):" % len(failed))
+        for file_path, failures in failed:
+            for stage, reason in sorted(failures.items()):
+                log_action(" - %s [%s] %s" % (relative_file_path(file_path), stage, reason))
+                print(" - %s [%s] %s" % (relative_file_path(file_path), stage, reason))
+
     def write_travel_history():
         for p in PEOPLE:
             travel_history = "Travel History, from my Photos\n"
@@ -1750,11 +3495,15 @@ try:
 
     def cli():
         global ARGS
+        global DEVICE_JOBS
+        global METADATA_WORKERS
+        global PREFETCH_FILES
+        global PREFETCH_BYTES
         # print(photohash.hash_distance("e5a6a6e5a4a4e5a7", "1a58dada189a9a58"))
         # return
 
         parser = argparse.ArgumentParser(description='Importer project')
-        parser.add_argument('source_dir', metavar='source_dir', type=str, help='What directory to import from?')
+        parser.add_argument('source_dirs', metavar='source_dir', type=str, nargs='+', help='What directories to import from?')
         parser.add_argument('destination', metavar='destination', type=str, help='What volume to import to? e.g. ./output/')
         parser.add_argument(
             '--keep-history', action='store_true',
@@ -1777,6 +3526,76 @@ try:
             '--dry-run', action='store_true',
             help="Run through all steps, but don't copy - just output the log."
         )
+        parser.add_argument(
+            '--no-streaming', action='store_true',
+            help="List the whole source directory before checking any files."
+        )
+        parser.add_argument(
+            '--full-rescan', action='store_true',
+            help="Ignore the saved directory index and list every source directory again."
+        )
+        parser.add_argument(
+            '--rebuild-file-cache', action='store_true',
+            help="Ignore saved EXIF, image hashes and md5s from earlier runs and extract every file again."
+        )
+        parser.add_argument(
+            '--files-from', metavar='FILE', type=str,
+            help="Import only the files listed in FILE (NUL- or newline-delimited, '-' for stdin) instead of walking the source directories."
+        )
+        parser.add_argument(
+            '--since', type=parse_date_arg,
+            help="Only import files modified on or after this date (YYYY-MM-DD)."
+        )
+        parser.add_argument(
+            '--until', type=parse_date_arg,
+            help="Only import files modified on or before this date (YYYY-MM-DD)."
+        )
+        parser.add_argument(
+            '--min-size', type=parse_size_arg,
+            help="Only import files at least this big, e.g. 500K or 2M."
+        )
+        parser.add_argument(
+            '--max-size', type=parse_size_arg,
+            help="Only import files at most this big, e.g. 500K or 2G."
+        )
+        parser.add_argument(
+            '--ext', type=str,
+            help="Only import files with these extensions, comma-separated, e.g. jpg,mp4."
+        )
+        parser.add_argument(
+            '--device-jobs', type=parse_positive_int_arg, default=DEVICE_JOBS,
+            help="How many directories or files to read at once per disk, across all sources. The default (%s) "
+                 "is effectively no per-disk limit; use 1 for spinning disks." % DEVICE_JOBS
+        )
+        parser.add_argument(
+            '--workers', type=int, default=METADATA_WORKERS,
+            help="How many processes to use for EXIF parsing and image hashing. Results are still applied in order."
+        )
+        parser.add_argument(
+            '--physical-order', action='store_true',
+            help="Check and copy files in the order they sit on disk rather than folder order. Much faster on "
+                 "spinning disks, but when files are duplicates, which one is kept can change."
+        )
+        parser.add_argument(
+            '--report-failures', action='store_true',
+            help="At the end, list files that failed EXIF, image decoding or hashing, including on earlier runs."
+        )
+        parser.add_argument(
+            '--retry-failures', action='store_true',
+            help="Extract and hash files again even if they failed on an earlier run and haven't changed since."
+        )
+        parser.add_argument(
+            '--prefetch', type=int, default=PREFETCH_FILES,
+            help="How many files ahead of EXIF parsing to start reading images from disk. 0 turns it off."
+        )
+        parser.add_argument(
+            '--prefetch-budget', type=parse_size_arg, default=PREFETCH_BYTES,
+            help="At most this much image data read ahead at once, e.g. 256M."
+        )
+        parser.add_argument(
+            '--watch', action='store_true',
+            help="After the import, keep running and import new files as they arrive in the source directories."
+        )
 
         args = parser.parse_args()
         # print(args)
@@ -1794,11 +3613,26 @@ try:
             brain["date_state"] = {}
             brain["month_country"] = {}
 
-        args.full_source_path = os.path.abspath(args.source_dir)
+        args.source_dir = ", ".join(args.source_dirs)
+        if args.since:
+            args.since_ns = int(args.since.timestamp() * 1e9)
+        if args.until:
+            # --until includes the whole day.
+            args.until_ns = int((args.until + datetime.timedelta(days=1)).timestamp() * 1e9)
+        if args.ext:
+            args.ext = set(e.strip().lstrip(".").lower() for e in args.ext.split(","))
         ARGS = args
+        DEVICE_JOBS = args.device_jobs
+        METADATA_WORKERS = args.workers
+        PREFETCH_FILES = args.prefetch
+        PREFETCH_BYTES = args.prefetch_budget
 
         prepare_import_dir(args)
         pull_files(args)
+        if args.watch:
+            watch_source(args)
+        if args.report_failures:
+            report_failures()
 
         print("\nFinished import for %s" % args.source_dir)
         # walk_tree(args)
@@ -1807,6 +3641,7 @@ try:
         print("✔ Saving brain.")
         with open('importamator.db', "w+b") as f:
             pickle.dump(brain, f)
+        write_file_cache(args.source_dirs)
 
         print("✔ Creating Reports.")
         write_import_log()